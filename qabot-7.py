@@ -6,7 +6,14 @@ Modified to include encouragement for job seekers
 """
 
 import os
+import bisect
+import codecs
 import random
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import zlib
 from getpass import getpass
 import warnings
 warnings.filterwarnings('ignore')
@@ -139,11 +146,12 @@ from ibm_watsonx_ai.foundation_models import ModelInference
 from ibm_watsonx_ai.metanames import GenTextParamsMetaNames as GenParams
 from ibm_watsonx_ai.metanames import EmbedTextParamsMetaNames
 from langchain_ibm import WatsonxLLM, WatsonxEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
+from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+from langchain.schema import Document as LangChainDocument
 from langchain.chains import RetrievalQA
 import gradio as gr
+import numpy as np
 
 # === CORE FUNCTIONS WITH ERROR HANDLING ===
 
@@ -168,8 +176,42 @@ def get_llm():
         print(f"❌ Error initializing LLM: {e}")
         raise
 
+# Select with RAG_EMBEDDING_BACKEND=hashing to run retrieval fully offline
+EMBEDDING_BACKEND = os.getenv('RAG_EMBEDDING_BACKEND', 'watsonx').lower()
+TERM_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9+#]+)*")
+
+class HashingEmbeddings:
+    """CPU-only signed feature-hashing embeddings over terms and term bigrams"""
+    
+    def __init__(self, dim=1024):
+        self.dim = dim
+    
+    def embed_documents(self, texts):
+        texts = list(texts)
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            terms = TERM_PATTERN.findall(text.lower())
+            for feature in terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]:
+                # crc32 rather than hash() so vectors are stable across processes
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                cols.append(h % self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), signs)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return matrix.tolist()
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
 def watsonx_embedding():
     """Initialize embeddings with error handling"""
+    if EMBEDDING_BACKEND == "hashing":
+        print("🧭 Using local hashing embeddings")
+        return HashingEmbeddings()
+    
     try:
         embed_params = {
             EmbedTextParamsMetaNames.TRUNCATE_INPUT_TOKENS: 3,
@@ -198,6 +240,53 @@ def get_file_icon(file_extension):
     }
     return icons.get(file_extension.lower(), '📎')
 
+# Byte-order marks, longest first so UTF-32 LE is not mistaken for UTF-16 LE
+TEXT_BOMS = [
+    (b'\x00\x00\xfe\xff', 'utf-32'),
+    (b'\xff\xfe\x00\x00', 'utf-32'),
+    (b'\xef\xbb\xbf', 'utf-8-sig'),
+    (b'\xfe\xff', 'utf-16'),
+    (b'\xff\xfe', 'utf-16'),
+]
+
+def detect_text_encoding(data, sample_size=65536):
+    """Guess a text encoding from the BOM or a bounded sample of the bytes"""
+    for bom, encoding in TEXT_BOMS:
+        if data.startswith(bom):
+            return encoding
+    
+    sample = data[:sample_size]
+    # UTF-16 without a BOM: ASCII text leaves every other byte NUL
+    if sample and sample.count(b'\x00') > len(sample) // 4:
+        return 'utf-16-le' if sample[1::2].count(0) > sample[0::2].count(0) else 'utf-16-be'
+    
+    try:
+        # final=False tolerates a multi-byte character cut off at the sample end
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+def load_text_document(file_path):
+    """Read a text file once, detect its encoding and decode it once"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    
+    encoding = detect_text_encoding(data)
+    try:
+        text = data.decode(encoding)
+    except UnicodeDecodeError:
+        # Only reached when bytes past the sample disagree with the guess;
+        # latin-1 maps every byte, so this always succeeds
+        encoding = 'latin-1'
+        text = data.decode(encoding)
+    
+    print(f"✅ Successfully detected text encoding: {encoding}")
+    return [LangChainDocument(
+        page_content=text,
+        metadata={'source': file_path, 'encoding': encoding}
+    )]
+
 def document_loader_universal(file):
     """
     Universal document loader supporting PDF, DOC, DOCX, and TXT files
@@ -264,27 +353,9 @@ def document_loader_universal(file):
                     raise ValueError(f"Failed to load {file_extension} file: {fallback_error}")
             
         elif file_extension == '.txt':
-            # Enhanced text file support with encoding detection
-            encodings_to_try = ['utf-8', 'utf-16', 'latin-1', 'cp1252', 'iso-8859-1']
-            
-            loader = None
-            successful_encoding = None
-            
-            for encoding in encodings_to_try:
-                try:
-                    loader = TextLoader(file_path, encoding=encoding)
-                    # Test if it can actually load
-                    test_load = loader.load()
-                    successful_encoding = encoding
-                    print(f"✅ Successfully detected text encoding: {encoding}")
-                    break
-                except (UnicodeDecodeError, UnicodeError):
-                    continue
-                except Exception:
-                    continue
-            
-            if loader is None:
-                raise ValueError(f"Could not determine text file encoding. Tried: {encodings_to_try}")
+            # Single read and decode with BOM/sample-based encoding detection
+            loaded_document = load_text_document(file_path)
+            return _finalize_document_loading(loaded_document, file_path, file_extension)
                 
         else:
             supported_types = ['.pdf', '.doc', '.docx', '.txt']
@@ -330,19 +401,114 @@ def _finalize_document_loading(loaded_document, file_path, file_extension):
     
     return loaded_document
 
+# One-pass splitter: separator positions are found once per section and each
+# chunk ends at the last (coarsest) separator that fits, instead of recursively
+# re-splitting strings like RecursiveCharacterTextSplitter. Chunks carry their
+# start_index/end_index offsets. RAG_CHUNK_LENGTH=tokens measures size in
+# tiktoken tokens (or words and punctuation when tiktoken is unavailable).
+CHUNK_LENGTH_UNIT = os.getenv('RAG_CHUNK_LENGTH', 'chars').lower()
+TOKEN_MARK_PATTERN = re.compile(r'\w+|[^\w\s]')
+chunk_encoding = None
+
+def token_marks(text):
+    """Start offsets of the tokens in text, followed by len(text)"""
+    global chunk_encoding
+    if chunk_encoding is None:
+        try:
+            import tiktoken
+            chunk_encoding = tiktoken.get_encoding(os.getenv('RAG_CHUNK_TOKENIZER', 'cl100k_base'))
+        except Exception:
+            chunk_encoding = False
+    if chunk_encoding:
+        _, marks = chunk_encoding.decode_with_offsets(chunk_encoding.encode_ordinary(text))
+    else:
+        marks = [match.start() for match in TOKEN_MARK_PATTERN.finditer(text)]
+    return list(marks) + [len(text)]
+
+class TextSplitter:
+    """Overlapping chunks as offset slices, computed in one pass per section"""
+    
+    def __init__(self, chunk_size=1000, chunk_overlap=200, separators=("\n\n", "\n", " "), length_unit=CHUNK_LENGTH_UNIT):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators
+        self.length_unit = length_unit
+    
+    def split_spans(self, text):
+        length = len(text)
+        marks = token_marks(text) if self.length_unit == "tokens" else None
+        
+        def move(position, count):
+            if marks is None:
+                return min(max(position + count, 0), length)
+            index = bisect.bisect_left(marks, position) + count
+            return marks[min(max(index, 0), len(marks) - 1)]
+        
+        boundaries = [[m.start() for m in re.finditer(re.escape(sep), text)] for sep in self.separators]
+        
+        def last_break(separators, low, high):
+            for positions in separators:
+                index = bisect.bisect_right(positions, high) - 1
+                if index >= 0 and positions[index] >= low:
+                    return positions[index]
+            return None
+        
+        spans = []
+        start = 0
+        last_end = 0
+        while True:
+            while start < length and text[start].isspace():
+                start += 1
+            if start >= length:
+                return spans
+            
+            # A coarse separator only wins once the chunk is half full, and
+            # each chunk must reach past the previous one
+            limit = move(start, self.chunk_size)
+            if limit >= length:
+                end = length
+            else:
+                floor = max(move(start, self.chunk_size // 2), last_end + 1)
+                end = (
+                    last_break(boundaries, floor, limit)
+                    or last_break(boundaries[-1:], max(start, last_end) + 1, limit)
+                    or limit
+                )
+            last_end = end
+            
+            stripped_end = end
+            while stripped_end > start and text[stripped_end - 1].isspace():
+                stripped_end -= 1
+            if stripped_end > start and (not spans or stripped_end > spans[-1][1]):
+                spans.append((start, stripped_end))
+            if end >= length:
+                return spans
+            
+            # Overlap: restart up to chunk_overlap back, on a word boundary
+            finest = boundaries[-1]
+            back = move(end, -self.chunk_overlap)
+            index = bisect.bisect_left(finest, back)
+            candidate = finest[index] if index < len(finest) else back
+            start = candidate if self.chunk_overlap and start < candidate < end else end
+    
+    def split_documents(self, documents):
+        return [
+            LangChainDocument(
+                page_content=doc.page_content[start:end],
+                metadata={**doc.metadata, 'start_index': start, 'end_index': end}
+            )
+            for doc in documents
+            for start, end in self.split_spans(doc.page_content)
+        ]
+
 def text_splitter(data):
     """Split text into chunks with improved configuration"""
     try:
         if not data:
             raise ValueError("No document data provided")
         
-        # Improved text splitter configuration
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,  # Increased overlap for better continuity
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]  # Better separation hierarchy
-        )
+        # 1000-character chunks with 200 of overlap for continuity
+        text_splitter = TextSplitter(chunk_size=1000, chunk_overlap=200)
         chunks = text_splitter.split_documents(data)
         
         if not chunks:
@@ -356,6 +522,8 @@ def text_splitter(data):
 
 def vector_database(chunks):
     """Create vector database with improved configuration"""
+    # Each build gets its own collection: sessions keep their retrievers alive,
+    # and the default "langchain" collection would be shared between them
     try:
         if not chunks:
             raise ValueError("No chunks provided for vector database")
@@ -366,6 +534,7 @@ def vector_database(chunks):
         vectordb = Chroma.from_documents(
             documents=chunks, 
             embedding=embedding_model,
+            collection_name=f"qabot_{uuid.uuid4().hex}",
             collection_metadata={"hnsw:space": "cosine"}  # Better similarity metric
         )
         print("✅ Created vector database")
@@ -395,7 +564,146 @@ def create_retriever(file):
         print(f"❌ Error creating retriever: {e}")
         raise
 
-def retriever_qa(file, query):
+# === SESSION RETRIEVERS ===
+# Each browser session keeps the retriever for its uploaded file in a gr.State,
+# keyed by file path and modification time. It is built once when the file is
+# uploaded and reused by every chat turn, so follow-up questions don't reload
+# and re-embed the document. The in-memory collection is dropped when the file
+# changes or the session ends (after QABOT_SESSION_TTL seconds at the latest).
+SESSION_TTL = int(os.getenv('QABOT_SESSION_TTL', '3600'))
+
+def session_retriever(file, session):
+    """Return (retriever, file_metadata) for file, reusing the session's if unchanged"""
+    file_path = file.name if hasattr(file, 'name') else str(file)
+    key = [file_path, os.path.getmtime(file_path)]
+    
+    # An upload build and the first question can arrive together
+    with session.setdefault("lock", threading.Lock()):
+        if session.get("key") == key:
+            print(f"⚡ Reusing session retriever for {os.path.basename(file_path)}")
+            return session["retriever"], session["file_metadata"]
+        
+        release_session_retriever(session)
+        # A new document starts a new conversation
+        session.pop("memory", None)
+        retriever_obj, file_metadata = create_retriever(file)
+        session.update(key=key, retriever=retriever_obj, file_metadata=file_metadata)
+        return retriever_obj, file_metadata
+
+def release_session_retriever(session):
+    """Free the in-memory vector collection held by a session, if any"""
+    if not session or session.get("retriever") is None:
+        return
+    try:
+        session["retriever"].vectorstore.delete_collection()
+    except Exception as e:
+        print(f"⚠️  Could not release session vector collection: {e}")
+    session.update(key=None, retriever=None, file_metadata=None)
+
+# === CONVERSATION MEMORY ===
+# Follow-ups like "what about the second one?" are rewritten into a standalone
+# question from the conversation before retrieval. The memory handed to the LLM
+# stays the same size however long the chat gets: the last QABOT_MEMORY_TURNS
+# exchanges verbatim (each clipped to QABOT_MEMORY_TURN_CHARS), with older ones
+# folded into a running summary of at most QABOT_SUMMARY_MAX_CHARS characters.
+# Folding runs on a small background pool after the answer is returned, so it
+# never adds an LLM call to the user's wait; until it finishes, the oldest turn
+# simply stays verbatim. QABOT_CONVERSATIONAL=0 answers every question on its
+# own, as before.
+CONVERSATIONAL = os.getenv('QABOT_CONVERSATIONAL', '1').lower() in ('1', 'true', 'yes')
+MEMORY_TURNS = int(os.getenv('QABOT_MEMORY_TURNS', '3'))
+MEMORY_TURN_CHARS = int(os.getenv('QABOT_MEMORY_TURN_CHARS', '600'))
+SUMMARY_MAX_CHARS = int(os.getenv('QABOT_SUMMARY_MAX_CHARS', '1200'))
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+
+def new_memory():
+    return {"summary": "", "turns": [], "lock": threading.Lock(), "folding": False}
+
+CONDENSE_PROMPT = """Given the conversation so far and a follow-up question, rewrite the follow-up as one standalone question that can be understood without the conversation. Output only the question.
+
+Conversation summary:
+{summary}
+
+Recent exchanges:
+{turns}
+
+Follow-up question: {question}
+Standalone question:"""
+
+SUMMARY_PROMPT = """Progressively summarize the conversation, adding the new exchange to the previous summary. Keep names, numbers and facts from the document. Output only the new summary.
+
+Previous summary:
+{summary}
+
+New exchange:
+{turn}
+
+New summary:"""
+
+def _clip(text, limit):
+    """text cut to at most limit characters, on a word boundary"""
+    text = text.strip()
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(' ', 1)[0] + "…"
+
+def _format_turn(question, answer):
+    return f"User: {_clip(question, MEMORY_TURN_CHARS)}\nAssistant: {_clip(answer, MEMORY_TURN_CHARS)}"
+
+def condense_question(llm, memory, question):
+    """Rewrite a follow-up into a standalone question using the memory"""
+    if not memory:
+        return question
+    with memory["lock"]:
+        summary, turns = memory["summary"], list(memory["turns"])
+    if not (summary or turns):
+        return question
+    
+    prompt = CONDENSE_PROMPT.format(
+        summary=summary or "(none)",
+        turns="\n\n".join(_format_turn(q, a) for q, a in turns) or "(none)",
+        question=question
+    )
+    try:
+        lines = llm.invoke(prompt).strip().splitlines()
+    except Exception as e:
+        print(f"⚠️  Could not condense question, using it as asked: {e}")
+        return question
+    standalone = lines[0].strip() if lines else ""
+    return standalone or question
+
+def remember_turn(llm, memory, question, answer):
+    """Add an exchange to the memory; older ones are folded in the background"""
+    with memory["lock"]:
+        memory["turns"].append((question, answer))
+        if len(memory["turns"]) <= MEMORY_TURNS or memory["folding"]:
+            return
+        memory["folding"] = True
+    summary_executor.submit(fold_old_turns, llm, memory)
+
+def fold_old_turns(llm, memory):
+    """Fold turns beyond QABOT_MEMORY_TURNS into the summary, oldest first"""
+    while True:
+        with memory["lock"]:
+            if len(memory["turns"]) <= MEMORY_TURNS:
+                memory["folding"] = False
+                return
+            turn = _format_turn(*memory["turns"][0])
+            previous = memory["summary"]
+        
+        try:
+            summary = llm.invoke(SUMMARY_PROMPT.format(summary=previous or "(none)", turn=turn))
+        except Exception as e:
+            # Still bounded without the LLM: keep the most recent text
+            print(f"⚠️  Could not summarize conversation: {e}")
+            summary = f"{previous}\n{turn}"[-SUMMARY_MAX_CHARS:]
+        
+        # The turn leaves the verbatim list only once the summary covers it
+        with memory["lock"]:
+            memory["turns"].pop(0)
+            memory["summary"] = _clip(summary, SUMMARY_MAX_CHARS)
+
+def retriever_qa(file, query, session=None):
     """Main QA function with comprehensive error handling, file type display, and job seeker encouragement"""
     try:
         # Input validation
@@ -408,9 +716,20 @@ def retriever_qa(file, query):
         print(f"🔍 Processing query: {query}")
         print(f"📎 File: {file.name if hasattr(file, 'name') else file}")
         
-        # Initialize components
+        # Initialize components; a session reuses its retriever across turns
         llm = get_llm()
-        retriever_obj, file_metadata = create_retriever(file)
+        if session is not None:
+            retriever_obj, file_metadata = session_retriever(file, session)
+        else:
+            retriever_obj, file_metadata = create_retriever(file)
+        
+        # In a conversation, retrieve and answer for the standalone question
+        memory = None
+        if session is not None and CONVERSATIONAL:
+            memory = session.setdefault("memory", new_memory())
+        standalone_query = condense_question(llm, memory, query)
+        if standalone_query != query:
+            print(f"🧭 Standalone question: {standalone_query}")
         
         # Create QA chain
         qa = RetrievalQA.from_chain_type(
@@ -423,13 +742,16 @@ def retriever_qa(file, query):
         
         # Use invoke instead of deprecated __call__ method
         try:
-            response = qa.invoke({"query": query})
+            response = qa.invoke({"query": standalone_query})
             result = response.get('result', response) if isinstance(response, dict) else response
         except AttributeError:
             # Fallback for older LangChain versions
-            response = qa({"query": query})
+            response = qa({"query": standalone_query})
             result = response['result']
         
+        if memory is not None:
+            remember_turn(llm, memory, query, result)
+        
         # Add file info to response
         file_icon = file_metadata.get('file_icon', '📎')
         source_file = file_metadata.get('source_file', 'document')
@@ -458,6 +780,19 @@ def retriever_qa(file, query):
         encouragement = get_encouragement()
         return f"Sorry, I encountered an error while processing your request.\n\nError details: {str(e)}\n\nPlease check your file and try again.\n\n🌟 {encouragement}"
 
+# === QUEUEING ===
+# Every event that touches Watsonx goes through Gradio's queue, which shows
+# each waiting user their queue position. Questions share QABOT_LLM_WORKERS
+# workers and retriever builds QABOT_INDEX_WORKERS, whichever button or key
+# triggered them; at most QABOT_QUEUE_MAX_SIZE requests wait before new ones
+# are turned away. Each user has at most one question pending (later clicks
+# are ignored until it is answered), so one impatient user can't crowd the
+# queue. File info and clearing the chat skip the queue entirely, so they
+# never wait behind LLM calls.
+LLM_WORKERS = int(os.getenv('QABOT_LLM_WORKERS', '4'))
+INDEX_WORKERS = int(os.getenv('QABOT_INDEX_WORKERS', '2'))
+QUEUE_MAX_SIZE = int(os.getenv('QABOT_QUEUE_MAX_SIZE', '64'))
+
 # === ENHANCED GRADIO INTERFACE ===
 def create_gradio_interface():
     """Create an enhanced Gradio interface with multi-format support"""
@@ -490,7 +825,7 @@ def create_gradio_interface():
         except Exception as e:
             return f"Error reading file info: {str(e)}"
     
-    def process_query(file, query, history, file_info):
+    def process_query(file, query, history, file_info, session):
         """Process query and maintain chat history"""
         if not file:
             response = "⚠️ Please upload a document file first."
@@ -503,20 +838,33 @@ def create_gradio_interface():
             response = f"{response}\n\n🌟 {encouragement}"
             file_info_text = get_file_info(file)
         else:
-            response = retriever_qa(file, query)
+            response = retriever_qa(file, query, session)
             file_info_text = get_file_info(file)
         
         # Add to history
         history.append([query, response])
-        return history, "", file_info_text
+        return history, "", file_info_text, session
     
     def update_file_info(file):
         """Update file info display when file is uploaded"""
         return get_file_info(file)
     
-    def clear_chat():
+    def prepare_retriever(file, session):
+        """Build the session's retriever as soon as a file is uploaded"""
+        if file:
+            try:
+                session_retriever(file, session)
+            except Exception as e:
+                # The first question reports the error and retries the build
+                print(f"⚠️  Could not prepare retriever: {e}")
+        else:
+            release_session_retriever(session)
+        return session
+    
+    def clear_chat(session):
         """Clear chat history"""
-        return [], "No file uploaded"
+        session.pop("memory", None)
+        return [], "No file uploaded", session
     
     # Create the interface
     with gr.Blocks(title="RAG Document Q&A System", theme=gr.themes.Soft()) as app:
@@ -539,6 +887,13 @@ def create_gradio_interface():
                     label="File Information"
                 )
                 
+                # Per-session retriever for the uploaded file
+                session_state = gr.State(
+                    value={},
+                    time_to_live=SESSION_TTL,
+                    delete_callback=release_session_retriever
+                )
+                
                 with gr.Row():
                     clear_btn = gr.Button("🗑️ Clear Chat", variant="secondary", scale=1)
                 
@@ -578,26 +933,53 @@ def create_gradio_interface():
         file_upload.upload(
             update_file_info,
             inputs=[file_upload],
-            outputs=[file_info_display]
+            outputs=[file_info_display],
+            queue=False,
+            show_progress="hidden"
+        ).then(
+            prepare_retriever,
+            inputs=[file_upload, session_state],
+            outputs=[session_state],
+            concurrency_limit=INDEX_WORKERS,
+            concurrency_id="index"
+        )
+        
+        file_upload.clear(
+            prepare_retriever,
+            inputs=[file_upload, session_state],
+            outputs=[session_state],
+            concurrency_limit=INDEX_WORKERS,
+            concurrency_id="index"
         )
         
+        # Both ways of asking share one pool of LLM workers
         submit_btn.click(
             process_query,
-            inputs=[file_upload, query_input, chatbot, file_info_display],
-            outputs=[chatbot, query_input, file_info_display]
+            inputs=[file_upload, query_input, chatbot, file_info_display, session_state],
+            outputs=[chatbot, query_input, file_info_display, session_state],
+            concurrency_limit=LLM_WORKERS,
+            concurrency_id="llm",
+            trigger_mode="once"
         )
         
         query_input.submit(
             process_query,
-            inputs=[file_upload, query_input, chatbot, file_info_display],
-            outputs=[chatbot, query_input, file_info_display]
+            inputs=[file_upload, query_input, chatbot, file_info_display, session_state],
+            outputs=[chatbot, query_input, file_info_display, session_state],
+            concurrency_limit=LLM_WORKERS,
+            concurrency_id="llm",
+            trigger_mode="once"
         )
         
         clear_btn.click(
             clear_chat,
-            outputs=[chatbot, file_info_display]
+            inputs=[session_state],
+            outputs=[chatbot, file_info_display, session_state],
+            queue=False
         )
     
+    # Queued events without an explicit limit run one at a time
+    app.queue(default_concurrency_limit=1, max_size=QUEUE_MAX_SIZE, status_update_rate="auto")
     return app
 
 # === MAIN SETUP ===
@@ -637,7 +1019,9 @@ if __name__ == "__main__":
             server_port=7860, 
             share=False, 
             debug=False,
-            show_error=True
+            show_error=True,
+            # Room for every queue worker plus the unqueued file-info events
+            max_threads=LLM_WORKERS + INDEX_WORKERS + 8
         )
     else:
         print("❌ Failed to initialize application")
@@ -1,13 +1,32 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
 import os
 import uuid
 from pathlib import Path
 import shutil
-from typing import Optional
+from typing import Any, List, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from array import array
+import codecs
+import hashlib
+import json
+import logging
+import math
+import re
+import sqlite3
+import threading
+import zlib
+import time
 import asyncio
+import bisect
 import random
 import warnings
 from getpass import getpass
@@ -45,26 +64,28 @@ try:
     from ibm_watsonx_ai.metanames import GenTextParamsMetaNames as GenParams
     from ibm_watsonx_ai.metanames import EmbedTextParamsMetaNames
     from langchain_ibm import WatsonxLLM, WatsonxEmbeddings
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
     from langchain_community.vectorstores import Chroma
-    from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
-    from langchain.chains import RetrievalQA
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+    from langchain.schema import Document as LangChainDocument
+    from langchain.schema import BaseRetriever
+    import numpy as np
     RAG_AVAILABLE = True
     print("✅ RAG dependencies loaded successfully")
 except ImportError as e:
     print(f"⚠️  RAG dependencies not available: {e}")
     print("📦 Install with: pip install langchain-ibm langchain-community chromadb ibm-watsonx-ai python-docx")
     RAG_AVAILABLE = False
+    BaseRetriever = object  # keeps HybridRetriever definable in demo mode
 
 # === CREDENTIAL SETUP ===
 def setup_credentials():
     """Setup and validate IBM Watson credentials"""
     print("🔍 Checking IBM Watson credentials...")
-
+    
     from dotenv import load_dotenv
     from pathlib import Path
     import os
-
+    
     # Try environment variables first
     ibm_api_key = os.getenv('IBM_API_KEY')
     ibm_project_id = os.getenv('IBM_PROJECT_ID')
@@ -102,7 +123,7 @@ def setup_credentials():
                 print(f"   IBM_PROJECT_ID: {'found' if ibm_project_id else 'missing'}")
         else:
             print(f"⚠️  ~/.env file not found at {env_path}")
-            
+    
     except ImportError:
         print("⚠️  python-dotenv not installed")
         print("   Install with: pip install python-dotenv")
@@ -113,8 +134,183 @@ def setup_credentials():
     print("⚠️  IBM Watson credentials not found - using demo mode")
     return None, None
 
+# === METRICS ===
+# Per-stage timings, cache hit/miss counts and estimated token counts, kept in
+# process and exposed in Prometheus text format on /metrics. Each query and
+# ingestion job also collects its own stage breakdown; with RAG_METRICS_JSON_LOG
+# enabled that breakdown is written as one JSON line per job, so a slow query
+# can be pinned on embedding, Chroma or the LLM.
+METRICS_JSON_LOG = os.getenv('RAG_METRICS_JSON_LOG', '0').lower() in ('1', 'true', 'yes')
+METRICS_LOG_FILE = os.getenv('RAG_METRICS_LOG_FILE', '/var/log/FastAPI/rag-metrics.log')
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "rag_stage_duration_seconds": ("histogram", "Time spent in each pipeline stage"),
+    "rag_operation_duration_seconds": ("histogram", "End-to-end time of queries and ingestion jobs"),
+    "rag_embedding_call_duration_seconds": ("histogram", "Latency of individual embedding batch calls"),
+    "rag_http_request_duration_seconds": ("histogram", "HTTP request latency (time to response headers)"),
+    "rag_http_requests_total": ("counter", "HTTP requests by route and status"),
+    "rag_operations_total": ("counter", "Queries and ingestion jobs by outcome"),
+    "rag_chunks_indexed_total": ("counter", "Chunks embedded and written to Chroma"),
+    "rag_chunks_reused_total": ("counter", "Unchanged chunks kept from a previous index build"),
+    "rag_chunks_deleted_total": ("counter", "Stale chunks removed when a file was re-indexed"),
+    "rag_retrieved_chunks_total": ("counter", "Chunks retrieved as context for answers"),
+    "rag_llm_tokens_total": ("counter", "Estimated LLM prompt and completion tokens (4 characters per token)"),
+    "rag_cache_hits_total": ("counter", "Cache hits by cache"),
+    "rag_cache_misses_total": ("counter", "Cache misses by cache"),
+    "rag_embedding_rate_limited_total": ("counter", "Embedding calls rejected with HTTP 429"),
+    "rag_context_chunks_total": ("counter", "Retrieved chunks packed into or dropped from prompts"),
+    "rag_context_tokens_total": ("counter", "Estimated context tokens sent to the LLM"),
+    "rag_lexical_shortcuts_total": ("counter", "Hybrid queries answered from BM25 without a query embedding"),
+    "rag_uploads_deduplicated_total": ("counter", "Uploads attached to an existing identical index"),
+    "rag_indexes_released_total": ("counter", "Indexes dropped after their last upload was deleted"),
+}
+
+class Metrics:
+    """Thread-safe counters and histograms rendered in Prometheus text format"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+    
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+    
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+    
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+    
+    def render(self, gauges=()):
+        """Prometheus exposition text; gauges are (name, help, value[, labels]) tuples"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self.histograms.items())
+        
+        lines = []
+        described = set()
+        
+        def describe(name, kind, text):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for name, text, value, *labels in gauges:
+            describe(name, "gauge", text)
+            lines.append(f"{name}{self._labels(sorted(labels[0].items()) if labels else ())} {value}")
+        for (name, labels), value in counters:
+            describe(name, *METRIC_HELP.get(name, ("counter", name)))
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            describe(name, *METRIC_HELP.get(name, ("histogram", name)))
+            for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+trace_state = threading.local()
+
+def estimate_tokens(text):
+    """Cheap token estimate (about 4 characters per token)"""
+    return (len(text) + 3) // 4
+
+def current_trace():
+    return getattr(trace_state, "trace", None)
+
+def annotate_trace(**fields):
+    """Attach fields (file_id, query length, ...) to the current job's log line"""
+    trace = current_trace()
+    if trace is not None:
+        trace.update(fields)
+
+@contextmanager
+def traced(operation):
+    """Collect stage timings and counts for one query or ingestion job"""
+    previous = current_trace()
+    trace = {"operation": operation, "stages": {}, "counts": {}}
+    trace_state.trace = trace
+    start = time.perf_counter()
+    try:
+        yield trace
+    except Exception as e:
+        trace["error"] = str(e)
+        raise
+    finally:
+        trace_state.trace = previous
+        trace["duration"] = round(time.perf_counter() - start, 6)
+        outcome = "error" if trace.get("error") else "ok"
+        metrics.observe("rag_operation_duration_seconds", trace["duration"], operation=operation)
+        metrics.inc("rag_operations_total", operation=operation, outcome=outcome)
+        if METRICS_JSON_LOG:
+            trace["stages"] = {stage: round(seconds, 6) for stage, seconds in trace["stages"].items()}
+            trace["timestamp"] = time.time()
+            logging.getLogger("rag.metrics").info(json.dumps(trace, default=str))
+
+def record_stage(stage, seconds):
+    metrics.observe("rag_stage_duration_seconds", seconds, stage=stage)
+    trace = current_trace()
+    if trace is not None:
+        trace["stages"][stage] = trace["stages"].get(stage, 0.0) + seconds
+
+@contextmanager
+def stage_timer(stage):
+    """Time a block as one pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def count_event(name, amount=1, **labels):
+    """Increment rag_<name>_total and the current job's matching count"""
+    if not amount:
+        return
+    metrics.inc(f"rag_{name}_total", amount, **labels)
+    trace = current_trace()
+    if trace is not None:
+        key = ".".join([name, *labels.values()])
+        trace["counts"][key] = trace["counts"].get(key, 0) + amount
+
+def timed_iter(iterable, totals, key):
+    """Yield from iterable, adding the time spent producing items to totals[key]"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            totals[key] += time.perf_counter() - start
+            return
+        totals[key] += time.perf_counter() - start
+        yield item
+
 # === RAG FUNCTIONS ===
-def get_llm():
+def _create_llm():
     """Initialize the LLM with error handling"""
     if not RAG_AVAILABLE:
         raise ValueError("RAG dependencies not available")
@@ -138,7 +334,7 @@ def get_llm():
         print(f"❌ Error initializing LLM: {e}")
         raise
 
-def watsonx_embedding():
+def _create_embedding():
     """Initialize embeddings with error handling"""
     if not RAG_AVAILABLE:
         raise ValueError("RAG dependencies not available")
@@ -161,6 +357,299 @@ def watsonx_embedding():
         print(f"❌ Error initializing embeddings: {e}")
         raise
 
+# === EMBEDDING BACKENDS ===
+# watsonx_embedding() hands out whichever backend RAG_EMBEDDING_BACKEND names.
+# Any object with embed_documents(texts) and embed_query(text) will do, so more
+# backends can be added with register_embedding_backend(). The local backends
+# run on the CPU, with no Watsonx round-trip:
+#   hashing               - deterministic feature hashing of terms and bigrams,
+#                           for offline runs, CI and benchmarks
+#   sentence-transformers - a small local sentence-embedding model (optional dep)
+EMBEDDING_BACKEND = os.getenv('RAG_EMBEDDING_BACKEND', 'watsonx').lower()
+HASHING_EMBEDDING_DIM = int(os.getenv('RAG_HASHING_EMBEDDING_DIM', '1024'))
+LOCAL_EMBEDDING_MODEL = os.getenv('RAG_LOCAL_EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+
+class HashingEmbeddings:
+    """Signed feature-hashing vectorizer over terms and term bigrams"""
+    
+    def __init__(self, dim=HASHING_EMBEDDING_DIM):
+        self.dim = dim
+        self.model_id = f"local-hashing-{dim}"
+        self.params = {"features": "unigram+bigram"}
+    
+    def _features(self, text):
+        terms = tokenize_terms(text)
+        return terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+    
+    def embed_documents(self, texts):
+        texts = list(texts)
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                # crc32 rather than hash() so vectors are stable across processes
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                cols.append(h % self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), signs)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-12)
+        return matrix.tolist()
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class SentenceTransformerEmbeddings:
+    """Local sentence-transformers model run on the CPU"""
+    
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ValueError("sentence-transformers backend requires: pip install sentence-transformers")
+        self.model_id = model_name
+        self.params = {}
+        self.model = SentenceTransformer(model_name, device="cpu")
+    
+    def embed_documents(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=32, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.tolist()
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+embedding_backends = {
+    "watsonx": _create_embedding,
+    "hashing": HashingEmbeddings,
+    "sentence-transformers": SentenceTransformerEmbeddings,
+}
+
+def register_embedding_backend(name, factory):
+    """Make an embeddings factory selectable through RAG_EMBEDDING_BACKEND"""
+    embedding_backends[name.lower()] = factory
+
+def _create_configured_embedding():
+    factory = embedding_backends.get(EMBEDDING_BACKEND)
+    if factory is None:
+        raise ValueError(f"Unknown embedding backend '{EMBEDDING_BACKEND}'. Choose from: {', '.join(embedding_backends)}")
+    print(f"🧭 Using '{EMBEDDING_BACKEND}' embedding backend")
+    return factory()
+
+# === CLIENT POOL ===
+# Watsonx clients are expensive to build (each one fetches an IAM token and
+# opens its own HTTP session), so each kind is created once per set of
+# credentials and shared by every request. A daemon thread refreshes their
+# auth tokens ahead of expiry so requests never pay for a token fetch.
+TOKEN_REFRESH_SECONDS = int(os.getenv('RAG_TOKEN_REFRESH_SECONDS', '1200'))
+
+client_pool = {}
+client_pool_lock = threading.Lock()
+token_refresher = None
+
+def _pooled_client(kind, factory):
+    """Return the shared client of this kind, creating it on first use"""
+    if not RAG_AVAILABLE:
+        raise ValueError("RAG dependencies not available")
+    
+    key = (kind, os.environ.get('IBM_PROJECT_ID'), os.environ.get('IBM_API_KEY'))
+    client = client_pool.get(key)
+    if client is not None:
+        return client
+    
+    with client_pool_lock:
+        client = client_pool.get(key)
+        if client is None:
+            # Drop clients built with credentials that have since changed
+            for stale_key in [k for k in client_pool if k[0] == kind]:
+                del client_pool[stale_key]
+            client = factory()
+            client_pool[key] = client
+            print(f"🔌 Created pooled {kind} client")
+    _start_token_refresher()
+    return client
+
+def get_llm():
+    """Shared Watsonx LLM client"""
+    return _pooled_client("llm", _create_llm)
+
+def watsonx_embedding():
+    """Shared embeddings client for the configured backend (Watsonx by default)"""
+    return _pooled_client(f"embedding:{EMBEDDING_BACKEND}", _create_configured_embedding)
+
+def _api_client(client):
+    """Find the ibm_watsonx_ai APIClient inside a LangChain wrapper"""
+    for attr in ('watsonx_model', 'watsonx_embed'):
+        inner = getattr(client, attr, None)
+        api_client = getattr(inner, '_client', None)
+        if api_client is not None:
+            return api_client
+    return None
+
+def refresh_client_tokens():
+    """Touch each pooled client's token so it is renewed before it expires"""
+    with client_pool_lock:
+        clients = list(client_pool.items())
+    for (kind, _, _), client in clients:
+        api_client = _api_client(client)
+        if api_client is None:
+            continue
+        try:
+            # APIClient.token re-issues the IAM token when it is close to expiry
+            api_client.token
+        except Exception as e:
+            print(f"⚠️  Token refresh failed for {kind} client: {e}")
+
+def _start_token_refresher():
+    global token_refresher
+    if token_refresher is not None or TOKEN_REFRESH_SECONDS <= 0:
+        return
+    
+    def refresh_loop():
+        while True:
+            time.sleep(TOKEN_REFRESH_SECONDS)
+            refresh_client_tokens()
+    
+    with client_pool_lock:
+        if token_refresher is None:
+            token_refresher = threading.Thread(target=refresh_loop, name="token-refresh", daemon=True)
+            token_refresher.start()
+
+def warm_up_clients():
+    """Create the pooled clients up front so the first request is not slow"""
+    if not RAG_AVAILABLE or not (os.getenv('IBM_API_KEY') and os.getenv('IBM_PROJECT_ID')):
+        return False
+    try:
+        get_llm()
+        watsonx_embedding()
+        print("🔥 Watsonx clients warmed up")
+        return True
+    except Exception as e:
+        print(f"⚠️  Client warm-up failed: {e}")
+        return False
+
+# === EMBEDDING CACHE ===
+# Content-addressed on-disk store of chunk embeddings, keyed by a hash of the
+# embedding model, its parameters and the chunk text. Re-uploading the same
+# document (or sharing chunks with an earlier one) only sends the cache misses
+# to Watsonx. Vectors are stored as raw float32 blobs in SQLite.
+EMBEDDING_CACHE_PATH = os.getenv('RAG_EMBEDDING_CACHE', 'embedding_cache.sqlite3')
+
+class EmbeddingCache:
+    """SQLite-backed float32 vector store keyed by content hash"""
+    
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(namespace, text):
+        return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+    
+    def get_many(self, keys):
+        """Return {key: vector} for the keys present in the cache"""
+        found = {}
+        with self.lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+        return found
+    
+    def put_many(self, items):
+        """Store (key, vector) pairs"""
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array('f', vector).tobytes()) for key, vector in items]
+            )
+            self.conn.commit()
+    
+    def record(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+        count_event("cache_hits", hits, cache="embedding")
+        count_event("cache_misses", misses, cache="embedding")
+    
+    def stats(self):
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"entries": count, "hits": self.hits, "misses": self.misses}
+
+class CachedEmbeddings:
+    """Embeddings wrapper that serves chunk vectors from an EmbeddingCache"""
+    
+    def __init__(self, embedding_model, cache):
+        self.embedding_model = embedding_model
+        self.cache = cache
+        params = getattr(embedding_model, 'params', None) or {}
+        self.namespace = json.dumps(
+            [getattr(embedding_model, 'model_id', type(embedding_model).__name__), params],
+            sort_keys=True, default=str
+        )
+    
+    def embed_documents(self, texts):
+        texts = list(texts)
+        keys = [self.cache.make_key(self.namespace, text) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+        
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        
+        self.cache.record(len(texts) - len(missing), len(missing))
+        if missing:
+            vectors = self.embedding_model.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(new_items)
+            cached.update(new_items)
+            print(f"🧮 Embedded {len(missing)} new chunk(s), {len(texts) - len(missing)} from cache")
+        else:
+            print(f"⚡ All {len(texts)} chunk embeddings served from cache")
+        
+        return [cached[key] for key in keys]
+    
+    def embed_query(self, text):
+        return self.embedding_model.embed_query(text)
+
+embedding_cache = None
+
+def get_embedding_cache():
+    """Open the shared embedding cache, or return None when disabled"""
+    global embedding_cache
+    if embedding_cache is None and EMBEDDING_CACHE_PATH:
+        try:
+            embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+        except Exception as e:
+            print(f"⚠️  Embedding cache unavailable: {e}")
+            return None
+    return embedding_cache
+
+def cached_embedding():
+    """Watsonx embeddings with the on-disk cache in front, if enabled"""
+    embedding_model = watsonx_embedding()
+    cache = get_embedding_cache()
+    if cache is None:
+        return embedding_model
+    return CachedEmbeddings(embedding_model, cache)
+
 def get_file_icon(file_extension):
     """Get appropriate emoji icon for file type"""
     icons = {
@@ -171,6 +660,53 @@ def get_file_icon(file_extension):
     }
     return icons.get(file_extension.lower(), '📎')
 
+# Byte-order marks, longest first so UTF-32 LE is not mistaken for UTF-16 LE
+TEXT_BOMS = [
+    (b'\x00\x00\xfe\xff', 'utf-32'),
+    (b'\xff\xfe\x00\x00', 'utf-32'),
+    (b'\xef\xbb\xbf', 'utf-8-sig'),
+    (b'\xfe\xff', 'utf-16'),
+    (b'\xff\xfe', 'utf-16'),
+]
+
+def detect_text_encoding(data, sample_size=65536):
+    """Guess a text encoding from the BOM or a bounded sample of the bytes"""
+    for bom, encoding in TEXT_BOMS:
+        if data.startswith(bom):
+            return encoding
+    
+    sample = data[:sample_size]
+    # UTF-16 without a BOM: ASCII text leaves every other byte NUL
+    if sample and sample.count(b'\x00') > len(sample) // 4:
+        return 'utf-16-le' if sample[1::2].count(0) > sample[0::2].count(0) else 'utf-16-be'
+    
+    try:
+        # final=False tolerates a multi-byte character cut off at the sample end
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+def load_text_document(file_path):
+    """Read a text file once, detect its encoding and decode it once"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    
+    encoding = detect_text_encoding(data)
+    try:
+        text = data.decode(encoding)
+    except UnicodeDecodeError:
+        # Only reached when bytes past the sample disagree with the guess;
+        # latin-1 maps every byte, so this always succeeds
+        encoding = 'latin-1'
+        text = data.decode(encoding)
+    
+    print(f"✅ Successfully detected text encoding: {encoding}")
+    return [LangChainDocument(
+        page_content=text,
+        metadata={'source': file_path, 'encoding': encoding}
+    )]
+
 def document_loader_universal(file_path):
     """Universal document loader supporting PDF, DOC, DOCX, and TXT files"""
     if not RAG_AVAILABLE:
@@ -186,7 +722,7 @@ def document_loader_universal(file_path):
         # Route to appropriate loader based on file type
         if file_extension == '.pdf':
             loader = PyPDFLoader(file_path)
-            
+        
         elif file_extension in ['.doc', '.docx']:
             try:
                 loader = Docx2txtLoader(file_path)
@@ -215,28 +751,16 @@ def document_loader_universal(file_path):
                         return _finalize_document_loading(loaded_document, file_path, file_extension)
                     else:
                         raise ValueError(".DOC files require conversion to .DOCX format")
-                        
+                
                 except ImportError:
                     raise ValueError("python-docx package required for DOCX files")
                 except Exception as fallback_error:
                     raise ValueError(f"Failed to load {file_extension} file: {fallback_error}")
-            
+        
         elif file_extension == '.txt':
-            encodings_to_try = ['utf-8', 'utf-16', 'latin-1', 'cp1252', 'iso-8859-1']
-            
-            loader = None
-            for encoding in encodings_to_try:
-                try:
-                    loader = TextLoader(file_path, encoding=encoding)
-                    test_load = loader.load()
-                    print(f"✅ Successfully detected text encoding: {encoding}")
-                    break
-                except (UnicodeDecodeError, UnicodeError):
-                    continue
-            
-            if loader is None:
-                raise ValueError(f"Could not determine text file encoding")
-                
+            loaded_document = load_text_document(file_path)
+            return _finalize_document_loading(loaded_document, file_path, file_extension)
+        
         else:
             supported_types = ['.pdf', '.doc', '.docx', '.txt']
             raise ValueError(f"Unsupported file type: {file_extension}. Supported types: {supported_types}")
@@ -244,7 +768,7 @@ def document_loader_universal(file_path):
         # Load the document
         loaded_document = loader.load()
         return _finalize_document_loading(loaded_document, file_path, file_extension)
-        
+    
     except Exception as e:
         error_msg = f"Error loading document: {str(e)}"
         print(f"❌ {error_msg}")
@@ -259,35 +783,244 @@ def _finalize_document_loading(loaded_document, file_path, file_extension):
     if total_chars == 0:
         raise ValueError(f"File appears to be empty")
     
-    file_icon = get_file_icon(file_extension)
     print(f"✅ Successfully loaded {len(loaded_document)} document section(s) with {total_chars:,} characters")
     
     # Enhanced metadata
+    file_size = os.path.getsize(file_path)
     for i, doc in enumerate(loaded_document):
-        doc.metadata.update({
-            'file_type': file_extension,
-            'source_file': os.path.basename(file_path),
-            'file_size_bytes': os.path.getsize(file_path),
-            'total_sections': len(loaded_document),
-            'section_index': i,
-            'character_count': len(doc.page_content),
-            'file_icon': file_icon
-        })
+        _set_section_metadata(doc, file_path, file_extension, i, len(loaded_document), file_size)
     
     return loaded_document
 
+def _set_section_metadata(doc, file_path, file_extension, index, total_sections, file_size):
+    """Attach the per-section metadata every loader path provides"""
+    doc.metadata.update({
+        'file_type': file_extension,
+        'source_file': os.path.basename(file_path),
+        'file_size_bytes': file_size,
+        'section_index': index,
+        'character_count': len(doc.page_content),
+        'file_icon': get_file_icon(file_extension)
+    })
+    # Chroma rejects None metadata values, so leave out an unknown total
+    if total_sections is not None:
+        doc.metadata['total_sections'] = total_sections
+
+def _pdf_page_count(file_path):
+    """Page count from the PDF trailer without extracting any text"""
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(file_path).pages)
+    except Exception:
+        return None
+
+def iter_document_pages(file_path):
+    """Yield a document's sections one at a time; PDFs are never fully loaded"""
+    file_extension = Path(file_path).suffix.lower()
+    if file_extension != '.pdf':
+        # DOC/DOCX/TXT load as a single section anyway
+        yield from document_loader_universal(file_path)
+        return
+    
+    if not RAG_AVAILABLE:
+        raise ValueError("RAG dependencies not available")
+    
+    print(f"{get_file_icon(file_extension)} Streaming PDF file: {file_path}")
+    total_pages = _pdf_page_count(file_path)
+    file_size = os.path.getsize(file_path)
+    page_count = 0
+    total_chars = 0
+    
+    try:
+        for index, page in enumerate(PyPDFLoader(file_path).lazy_load()):
+            _set_section_metadata(page, file_path, file_extension, index, total_pages, file_size)
+            page_count += 1
+            total_chars += len(page.page_content)
+            yield page
+    except Exception as e:
+        error_msg = f"Error loading document: {str(e)}"
+        print(f"❌ {error_msg}")
+        raise ValueError(error_msg)
+    
+    if total_chars == 0:
+        raise ValueError("File appears to be empty")
+    print(f"✅ Streamed {page_count} page(s) with {total_chars:,} characters")
+
+# === TEXT SPLITTING ===
+# Native replacement for LangChain's RecursiveCharacterTextSplitter. Instead of
+# recursively re-splitting and re-joining strings for every separator, the
+# positions of each separator are found once per section; each chunk boundary
+# is then a binary search for the last separator (in priority order) that still
+# fits, and the separator starts the next chunk. Chunks are slices of the
+# section and carry their character offsets as start_index/end_index metadata,
+# so a source span can be highlighted later without storing the text twice.
+#
+# Sizes are measured in characters, or with RAG_CHUNK_LENGTH=tokens in tokens
+# of RAG_CHUNK_TOKENIZER (tiktoken, optional dep; a word/punctuation count
+# otherwise). Token offsets are computed in the same single pass.
+CHUNK_SIZE = int(os.getenv('RAG_CHUNK_SIZE', '1000'))
+CHUNK_OVERLAP = int(os.getenv('RAG_CHUNK_OVERLAP', '200'))
+CHUNK_LENGTH_UNIT = os.getenv('RAG_CHUNK_LENGTH', 'chars').lower()
+CHUNK_TOKENIZER = os.getenv('RAG_CHUNK_TOKENIZER', 'cl100k_base')
+CHUNK_SEPARATORS = ["\n\n", "\n", " ", ""]
+TOKEN_MARK_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+chunk_encoding = None
+
+def _get_chunk_encoding():
+    """The tiktoken encoding for token-length chunks, or None to approximate"""
+    global chunk_encoding
+    if chunk_encoding is None:
+        try:
+            import tiktoken
+            chunk_encoding = tiktoken.get_encoding(CHUNK_TOKENIZER)
+        except Exception as e:
+            print(f"⚠️  tiktoken unavailable ({e}), approximating tokens by words and punctuation")
+            chunk_encoding = False
+    return chunk_encoding or None
+
+def token_marks(text):
+    """Sorted start offsets of the tokens in text, followed by len(text)"""
+    encoding = _get_chunk_encoding()
+    if encoding is not None:
+        # A character split over several tokens repeats its offset, so each
+        # token still counts once
+        _, marks = encoding.decode_with_offsets(encoding.encode_ordinary(text))
+    else:
+        marks = [match.start() for match in TOKEN_MARK_PATTERN.finditer(text)]
+    marks.append(len(text))
+    return marks
+
+class TextSplitter:
+    """One-pass splitter producing overlapping chunks as offset slices"""
+    
+    def __init__(self, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                 separators=CHUNK_SEPARATORS, length_unit=CHUNK_LENGTH_UNIT):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"Chunk overlap ({chunk_overlap}) must be smaller than chunk size ({chunk_size})")
+        if length_unit not in ("chars", "tokens"):
+            raise ValueError(f"Unknown chunk length unit '{length_unit}'. Choose from: chars, tokens")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # "" means "cut anywhere", which is what happens when nothing else fits
+        self.separators = [sep for sep in separators if sep]
+        self.length_unit = length_unit
+    
+    def _forward(self, marks, position, count):
+        """Offset count units after position"""
+        if marks is None:
+            return position + count
+        index = bisect.bisect_left(marks, position)
+        return marks[min(index + count, len(marks) - 1)]
+    
+    def _backward(self, marks, position, count):
+        """Offset count units before position"""
+        if marks is None:
+            return max(position - count, 0)
+        index = bisect.bisect_left(marks, position)
+        return marks[max(index - count, 0)]
+    
+    @staticmethod
+    def _last_break(boundaries, low, high):
+        """Last position in [low, high] of the coarsest separator having one"""
+        for positions in boundaries:
+            index = bisect.bisect_right(positions, high) - 1
+            if index >= 0 and positions[index] >= low:
+                return positions[index]
+        return None
+    
+    def split_spans(self, text):
+        """(start, end) offsets of each chunk, whitespace trimmed"""
+        length = len(text)
+        marks = token_marks(text) if self.length_unit == "tokens" else None
+        boundaries = [
+            [match.start() for match in re.finditer(re.escape(sep), text)]
+            for sep in self.separators
+        ]
+        
+        spans = []
+        start = 0
+        last_end = 0
+        while start < length:
+            while start < length and text[start].isspace():
+                start += 1
+            if start >= length:
+                break
+            
+            # Break at the last separator that fits, trying the coarsest first.
+            # A coarse separator only wins once the chunk is at least half
+            # full (so a heading isn't a chunk of its own), and every chunk
+            # must reach past the previous one (so none lies inside another).
+            limit = self._forward(marks, start, self.chunk_size)
+            if limit >= length:
+                end = length
+            else:
+                floor = max(self._forward(marks, start, self.chunk_size // 2), last_end + 1)
+                end = (
+                    self._last_break(boundaries, floor, limit)
+                    or self._last_break(boundaries[-1:], max(start, last_end) + 1, limit)
+                    or limit
+                )
+            last_end = end
+            
+            stripped_end = end
+            while stripped_end > start and text[stripped_end - 1].isspace():
+                stripped_end -= 1
+            # (only whitespace past the previous chunk adds nothing new)
+            if stripped_end > start and (not spans or stripped_end > spans[-1][1]):
+                spans.append((start, stripped_end))
+            if end >= length:
+                break
+            
+            # The next chunk starts up to chunk_overlap back, on a word boundary
+            next_start = end
+            if self.chunk_overlap:
+                back = self._backward(marks, end, self.chunk_overlap)
+                candidate = back
+                if boundaries:
+                    finest = boundaries[-1]
+                    index = bisect.bisect_left(finest, back)
+                    if index < len(finest):
+                        candidate = finest[index]
+                if start < candidate < end:
+                    next_start = candidate
+            start = next_start
+        return spans
+    
+    def split_text(self, text):
+        return [text[start:end] for start, end in self.split_spans(text)]
+    
+    def split_documents(self, documents):
+        """Chunk each document, copying its metadata and adding the offsets"""
+        chunks = []
+        for document in documents:
+            text = document.page_content
+            for start, end in self.split_spans(text):
+                chunks.append(LangChainDocument(
+                    page_content=text[start:end],
+                    metadata={**document.metadata, 'start_index': start, 'end_index': end}
+                ))
+        return chunks
+
+def _make_text_splitter():
+    return TextSplitter()
+
+def iter_chunks(pages):
+    """Split sections into chunks lazily, one section at a time"""
+    if not RAG_AVAILABLE:
+        raise ValueError("RAG dependencies not available")
+    
+    splitter = _make_text_splitter()
+    for page in pages:
+        yield from splitter.split_documents([page])
+
 def text_splitter(data):
     """Split text into chunks with improved configuration"""
     if not RAG_AVAILABLE:
         raise ValueError("RAG dependencies not available")
     
     try:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        text_splitter = _make_text_splitter()
         chunks = text_splitter.split_documents(data)
         
         if not chunks:
@@ -299,21 +1032,357 @@ def text_splitter(data):
         print(f"❌ Error splitting text: {e}")
         raise
 
+# === PERSISTENCE ===
+# With RAG_PERSIST=1 each file's Chroma collection lives in vector_db/<file_id>
+# and the upload registry is written to disk, so a restart only has to reopen
+# the collection on the first query instead of re-uploading and re-embedding.
+RAG_PERSIST = os.getenv('RAG_PERSIST', '0').lower() in ('1', 'true', 'yes')
+VECTOR_DB_DIR = Path(os.getenv('RAG_VECTOR_DB_DIR', 'vector_db'))
+
+# Chunks are embedded and inserted this many at a time, so only one batch of
+# text and vectors is held in memory however large the document is
+EMBED_BATCH_SIZE = int(os.getenv('RAG_EMBED_BATCH_SIZE', '64'))
+
+# === DOCUMENT TABLE ===
+# Per-file metadata (source file, type, size, icon, section count and whatever
+# the loader adds) is stored once per document here rather than copied onto
+# every chunk in Chroma. Chunks carry only their document id (file_id, the
+# index id) and their position in it: section_index and the start_index /
+# end_index character offsets within that section. The table is SQLite, kept
+# next to the vector indexes with RAG_PERSIST=1 and in memory otherwise;
+# migrate_vector_db() compacts collections written before it existed.
+CHUNK_METADATA_FIELDS = ('file_id', 'section_index', 'start_index', 'end_index')
+# Per-section fields that are dropped rather than moved to the document table
+SECTION_METADATA_FIELDS = ('page', 'page_label', 'character_count')
+DOCUMENT_TABLE_PATH = VECTOR_DB_DIR / "documents.sqlite3"
+DOCUMENT_TABLE_VERSION = 1
+
+def compact_chunk_metadata(metadata, doc_id):
+    """A chunk's metadata reduced to its document id and position"""
+    compact = {key: metadata[key] for key in CHUNK_METADATA_FIELDS if key in metadata}
+    compact['file_id'] = doc_id
+    return compact
+
+def document_fields(metadata):
+    """The document-level part of a section's or chunk's metadata"""
+    return {
+        key: value for key, value in metadata.items()
+        if key not in CHUNK_METADATA_FIELDS and key not in SECTION_METADATA_FIELDS
+    }
+
+class DocumentTable:
+    """SQLite table of per-document metadata keyed by document id"""
+    
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, metadata TEXT NOT NULL)"
+        )
+        self.conn.commit()
+    
+    def put(self, doc_id, metadata):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, metadata) VALUES (?, ?)",
+                (doc_id, json.dumps(metadata, default=str))
+            )
+            self.conn.commit()
+    
+    def get(self, doc_id):
+        """Metadata stored for doc_id, or {}"""
+        with self.lock:
+            row = self.conn.execute("SELECT metadata FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+    
+    def delete(self, doc_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            self.conn.commit()
+    
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    
+    @property
+    def version(self):
+        with self.lock:
+            return self.conn.execute("PRAGMA user_version").fetchone()[0]
+    
+    @version.setter
+    def version(self, value):
+        with self.lock:
+            self.conn.execute(f"PRAGMA user_version = {int(value)}")
+            self.conn.commit()
+
+if RAG_PERSIST:
+    VECTOR_DB_DIR.mkdir(parents=True, exist_ok=True)
+document_table = DocumentTable(DOCUMENT_TABLE_PATH if RAG_PERSIST else ":memory:")
+
+def _persisted_stores():
+    """(persist_dir, collection_name, doc_id) of every index under VECTOR_DB_DIR"""
+    if not VECTOR_DB_DIR.exists():
+        return []
+    stores = []
+    for persist_dir in sorted(VECTOR_DB_DIR.iterdir()):
+        if persist_dir.is_dir() and persist_dir.name != "collections":
+            stores.append((persist_dir, f"file_{persist_dir.name}", persist_dir.name))
+    collections_dir = VECTOR_DB_DIR / "collections"
+    if collections_dir.exists():
+        for persist_dir in sorted(collections_dir.iterdir()):
+            if persist_dir.is_dir():
+                # Collection chunks are already tagged with their file_id
+                stores.append((persist_dir, f"collection_{persist_dir.name}", None))
+    return stores
+
+def migrate_vector_db():
+    """Move per-file metadata off the chunks of existing vector_db/ indexes"""
+    if not (RAG_PERSIST and RAG_AVAILABLE) or document_table.version >= DOCUMENT_TABLE_VERSION:
+        return
+    
+    migrated = 0
+    for persist_dir, collection_name, doc_id in _persisted_stores():
+        try:
+            collection = Chroma(
+                collection_name=collection_name,
+                collection_metadata={"hnsw:space": "cosine"},
+                persist_directory=str(persist_dir)
+            )._collection
+            recorded = set()
+            offset = 0
+            while True:
+                page = collection.get(include=["metadatas"], limit=EMBED_BATCH_SIZE, offset=offset)
+                if not page["ids"]:
+                    break
+                offset += len(page["ids"])
+                
+                ids, metadatas = [], []
+                for cid, metadata in zip(page["ids"], page["metadatas"]):
+                    metadata = metadata or {}
+                    if set(metadata) <= set(CHUNK_METADATA_FIELDS):
+                        continue
+                    chunk_doc = metadata.get('file_id') or doc_id
+                    if chunk_doc not in recorded:
+                        document_table.put(chunk_doc, document_fields(metadata))
+                        recorded.add(chunk_doc)
+                    # Chroma merges metadata on update; None deletes a key
+                    update = {key: None for key in metadata if key not in CHUNK_METADATA_FIELDS}
+                    update.update(compact_chunk_metadata(metadata, chunk_doc))
+                    ids.append(cid)
+                    metadatas.append(update)
+                if ids:
+                    collection.update(ids=ids, metadatas=metadatas)
+                    migrated += len(ids)
+        except Exception as e:
+            # Leave the version alone so the migration is retried on next start
+            print(f"⚠️  Could not migrate {persist_dir}: {e}")
+            return
+    
+    document_table.version = DOCUMENT_TABLE_VERSION
+    if migrated:
+        print(f"🗜️  Compacted metadata of {migrated} chunk(s) into the document table")
+
+# === PARALLEL EMBEDDING ===
+# Chunk batches are embedded on a small shared pool so several Watsonx
+# round-trips are in flight at once. The number of concurrent requests halves
+# whenever Watsonx answers 429 and creeps back up after a run of successes.
+# Vectors are then bulk-inserted into Chroma, which never re-embeds them.
+EMBED_CONCURRENCY = int(os.getenv('RAG_EMBED_CONCURRENCY', '4'))
+EMBED_MAX_RETRIES = int(os.getenv('RAG_EMBED_MAX_RETRIES', '5'))
+
+# ibm_watsonx_ai reports failures as "... Status code: 429, body: ..."
+RATE_LIMIT_STATUS_PATTERN = re.compile(r'\b(?:status(?: code)?|http)\W{0,3}429\b')
+
+def _is_rate_limited(error):
+    """True if an embedding error looks like an HTTP 429"""
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    text = str(error).lower()
+    # Only a 429 status counts; the bare digits may be part of an id or a size
+    return (status == 429 or bool(RATE_LIMIT_STATUS_PATTERN.search(text))
+            or 'too many requests' in text or 'rate limit' in text)
+
+class AdaptiveLimiter:
+    """Concurrency limit that halves on rate limiting and recovers on success"""
+    
+    def __init__(self, max_limit):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.active = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+    
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+    
+    def release(self, rate_limited=False):
+        with self.condition:
+            self.active -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+                print(f"🐢 Embedding rate limited, concurrency lowered to {self.limit}")
+            else:
+                self.successes += 1
+                if self.limit < self.max_limit and self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+embed_limiter = AdaptiveLimiter(EMBED_CONCURRENCY)
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="embed")
+
+def embed_batch(embedding_model, texts):
+    """Embed one batch, backing off and retrying while rate limited"""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        embed_limiter.acquire()
+        start = time.perf_counter()
+        try:
+            vectors = embedding_model.embed_documents(texts)
+        except Exception as e:
+            rate_limited = _is_rate_limited(e)
+            embed_limiter.release(rate_limited)
+            if rate_limited:
+                count_event("embedding_rate_limited")
+            if not rate_limited or attempt == EMBED_MAX_RETRIES:
+                raise
+            time.sleep(min(30.0, 0.5 * 2 ** attempt) * (1 + random.random()))
+            continue
+        embed_limiter.release()
+        metrics.observe("rag_embedding_call_duration_seconds", time.perf_counter() - start)
+        return vectors
+
+def chunk_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def chunk_id(id_prefix, digest, occurrence=0):
+    """Content-derived chunk id, so an unchanged chunk keeps its id across rebuilds"""
+    return f"{id_prefix}-{digest}" if not occurrence else f"{id_prefix}-{digest}-{occurrence}"
+
+def existing_chunk_ids(vectordb, metadata_filter=None):
+    """Ids already stored in a collection (optionally only those matching a filter)"""
+    kwargs = {"where": metadata_filter} if metadata_filter else {}
+    return set(vectordb._collection.get(include=[], **kwargs)["ids"])
+
+def add_in_batches(vectordb, chunks, id_prefix=None, existing_ids=None):
+    """Embed an iterable of chunks in parallel batches and bulk-insert them"""
+    # Chunks whose id is in existing_ids are already indexed, so only their
+    # metadata is refreshed; existing ids that no longer occur are deleted
+    embedding_model = vectordb.embeddings
+    id_prefix = id_prefix or uuid.uuid4().hex
+    existing_ids = existing_ids or set()
+    # Bound the batches held in memory while their embeddings are in flight
+    pending = deque()
+    count = 0
+    embedded = 0
+    seen = set()
+    occurrences = {}
+    retained = []
+    # "embed" is only the time spent waiting on embeddings that loading and
+    # splitting did not already overlap with
+    timings = {"embed": 0.0, "index": 0.0}
+    
+    def insert_oldest():
+        ids, batch, future = pending.popleft()
+        wait_start = time.perf_counter()
+        vectors = future.result()
+        insert_start = time.perf_counter()
+        vectordb._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            metadatas=[chunk.metadata for chunk in batch],
+            documents=[chunk.page_content for chunk in batch]
+        )
+        timings["embed"] += insert_start - wait_start
+        timings["index"] += time.perf_counter() - insert_start
+    
+    def submit(batch):
+        ids = [cid for cid, _ in batch]
+        batch = [chunk for _, chunk in batch]
+        texts = [chunk.page_content for chunk in batch]
+        pending.append((ids, batch, embed_executor.submit(embed_batch, embedding_model, texts)))
+        while len(pending) > EMBED_CONCURRENCY * 2:
+            insert_oldest()
+    
+    def refresh_retained():
+        # Page numbers and section indexes may have shifted around the edit
+        with stage_timer("index"):
+            vectordb._collection.update(
+                ids=[cid for cid, _ in retained],
+                metadatas=[metadata for _, metadata in retained]
+            )
+        retained.clear()
+    
+    try:
+        batch = []
+        for chunk in chunks:
+            count += 1
+            # Keyed by digest so chunk texts aren't held for the whole ingest
+            digest = chunk_digest(chunk.page_content)
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            cid = chunk_id(id_prefix, digest, occurrence)
+            seen.add(cid)
+            if cid in existing_ids:
+                retained.append((cid, chunk.metadata))
+                if len(retained) >= EMBED_BATCH_SIZE:
+                    refresh_retained()
+                continue
+            
+            batch.append((cid, chunk))
+            embedded += 1
+            if len(batch) >= EMBED_BATCH_SIZE:
+                submit(batch)
+                batch = []
+        if batch:
+            submit(batch)
+        if retained:
+            refresh_retained()
+        while pending:
+            insert_oldest()
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+    
+    record_stage("embed", timings["embed"])
+    record_stage("index", timings["index"])
+    if count == 0:
+        raise ValueError("No chunks created from document")
+    
+    stale = list(existing_ids - seen)
+    for start in range(0, len(stale), 500):
+        vectordb._collection.delete(ids=stale[start:start + 500])
+    
+    count_event("chunks_indexed", embedded)
+    count_event("chunks_reused", count - embedded)
+    count_event("chunks_deleted", len(stale))
+    if existing_ids:
+        print(f"✅ Re-indexed {count} chunks: {embedded} embedded, {count - embedded} unchanged, {len(stale)} removed")
+    else:
+        print(f"✅ Indexed {count} chunks in batches of {EMBED_BATCH_SIZE} (up to {EMBED_CONCURRENCY} in parallel)")
+    return count
+
 def vector_database_persistant(chunks, file_id):
     """Create persistent vector database"""
     try:
-        embedding_model = watsonx_embedding()
+        embedding_model = cached_embedding()
         
-        # Create persistent storage directory
-        persist_dir = Path("vector_db") / file_id
+        # Create persistent storage directory; an earlier (possibly partial)
+        # build is kept and brought up to date chunk by chunk
+        persist_dir = VECTOR_DB_DIR / file_id
         persist_dir.mkdir(parents=True, exist_ok=True)
         
-        vectordb = Chroma.from_documents(
-            documents=chunks, 
-            embedding=embedding_model,
+        vectordb = Chroma(
+            embedding_function=embedding_model,
+            collection_name=f"file_{file_id}",
             collection_metadata={"hnsw:space": "cosine"},
             persist_directory=str(persist_dir)  # ← This makes it persistent
         )
+        add_in_batches(vectordb, chunks, id_prefix=file_id, existing_ids=existing_chunk_ids(vectordb))
         
         # Explicitly persist
         vectordb.persist()
@@ -323,50 +1392,711 @@ def vector_database_persistant(chunks, file_id):
     except Exception as e:
         print(f"❌ Error creating persistant vector database: {e}")
         raise
-    
-def vector_database(chunks):
+
+def vector_database(chunks, collection_name=None, id_prefix=None):
     """Create vector database with improved configuration"""
     if not RAG_AVAILABLE:
         raise ValueError("RAG dependencies not available")
     
     try:
-        embedding_model = watsonx_embedding()
+        embedding_model = cached_embedding()
         
-        vectordb = Chroma.from_documents(
-            documents=chunks, 
-            embedding=embedding_model,
+        # Give each file its own collection - in-memory Chroma instances share
+        # one client, so the default "langchain" collection would mix documents
+        vectordb = Chroma(
+            embedding_function=embedding_model,
+            collection_name=collection_name or f"doc_{uuid.uuid4().hex}",
             collection_metadata={"hnsw:space": "cosine"}
         )
+        # A named collection may still hold the file's previous version
+        existing_ids = existing_chunk_ids(vectordb) if collection_name else None
+        add_in_batches(vectordb, chunks, id_prefix=id_prefix, existing_ids=existing_ids)
         print("✅ Created vector database")
         return vectordb
     except Exception as e:
         print(f"❌ Error creating vector database: {e}")
         raise
 
-def create_retriever(file_path):
+# === HYBRID RETRIEVAL ===
+# Optional BM25 keyword index kept in-process next to each file's vector index.
+# Keyword-heavy questions (skill names, company names) are often answered by an
+# exact term match. When the lexical ranking clearly separates its top hits from
+# everything else, those hits are returned without embedding the query at all.
+# That includes a rare term matched by only a few chunks, as long as those are
+# at most RAG_HYBRID_MAX_HIT_FRACTION of the index (in a small file, a term in
+# most chunks separates nothing). Otherwise the BM25 and vector rankings are
+# merged with reciprocal rank fusion.
+HYBRID_RETRIEVAL = os.getenv('RAG_HYBRID', '0').lower() in ('1', 'true', 'yes')
+HYBRID_DECISIVE_RATIO = float(os.getenv('RAG_HYBRID_DECISIVE_RATIO', '2.0'))
+HYBRID_MIN_COVERAGE = float(os.getenv('RAG_HYBRID_MIN_COVERAGE', '0.5'))
+HYBRID_MAX_HIT_FRACTION = float(os.getenv('RAG_HYBRID_MAX_HIT_FRACTION', '0.25'))
+HYBRID_RRF_K = 60
+
+TERM_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9+#]+)*")
+STOP_WORDS = frozenset(
+    "a an and are as at be by can did do does for from has have he her his how i in "
+    "is it its me my of on or our she that the their them they this to was we were "
+    "what when where which who whom why will with you your".split()
+)
+
+def tokenize_terms(text):
+    """Lowercase search terms, keeping tokens like c++, c# and node.js intact"""
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOP_WORDS]
+
+class BM25Index:
+    """Inverted index over chunk text scored with Okapi BM25"""
+    
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.docs = []
+        self.doc_lengths = []
+        self.total_length = 0
+    
+    @classmethod
+    def from_store(cls, vectordb, metadata_filter=None):
+        """Rebuild the index from the chunks already stored in a Chroma collection"""
+        index = cls()
+        kwargs = {"where": metadata_filter} if metadata_filter else {}
+        stored = vectordb._collection.get(include=["documents", "metadatas"], **kwargs)
+        for text, metadata in zip(stored["documents"], stored["metadatas"]):
+            index.add(LangChainDocument(page_content=text, metadata=metadata or {}))
+        return index
+    
+    def add(self, doc):
+        doc_index = len(self.docs)
+        terms = tokenize_terms(doc.page_content)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_index] = tf
+        self.docs.append(doc)
+        self.doc_lengths.append(len(terms))
+        self.total_length += len(terms)
+    
+    def coverage(self, query):
+        """Fraction of the query's search terms that occur anywhere in the index"""
+        terms = set(tokenize_terms(query))
+        if not terms:
+            return 0.0
+        return sum(1 for term in terms if term in self.postings) / len(terms)
+    
+    def search(self, query, k):
+        """Return up to k (doc, score) pairs with a positive score, best first"""
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avg_length = self.total_length / n or 1.0
+        scores = {}
+        for term in set(tokenize_terms(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / avg_length)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.docs[doc_index], score) for doc_index, score in best]
+
+class HybridRetriever(BaseRetriever):
+    """Fuses BM25 and vector rankings, skipping the vector search when BM25 is decisive"""
+    
+    vector_store: Any
+    lexical_index: Any
+    k: int = 4
+    metadata_filter: Optional[dict] = None
+    
+    @property
+    def vectorstore(self):
+        return self.vector_store
+    
+    def _decisive_hits(self, lexical):
+        """Return the leading lexical hits that stand clear of the rest, or None"""
+        total = len(self.lexical_index.docs)
+        # Cut at the deepest rank (up to k) where the score drops by the ratio;
+        # past the last hit the next score is that of a non-matching chunk, 0
+        for cut in range(min(self.k, len(lexical)), 0, -1):
+            if cut < len(lexical):
+                if lexical[cut - 1][1] >= HYBRID_DECISIVE_RATIO * lexical[cut][1]:
+                    return lexical[:cut]
+            elif cut <= HYBRID_MAX_HIT_FRACTION * total:
+                return lexical
+        return None
+    
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        # One extra hit tells us whether the top k stand clear of the rest
+        lexical = self.lexical_index.search(query, self.k + 1)
+        if lexical and self.lexical_index.coverage(query) >= HYBRID_MIN_COVERAGE:
+            decisive = self._decisive_hits(lexical)
+            if decisive:
+                print(f"🔤 Keyword match decisive, skipped query embedding ({len(decisive)} chunks)")
+                count_event("lexical_shortcuts")
+                return [doc for doc, _ in decisive]
+        
+        search_kwargs = {"filter": self.metadata_filter} if self.metadata_filter else {}
+        vector_docs = self.vector_store.similarity_search(query, k=self.k * 2, **search_kwargs)
+        
+        # Reciprocal rank fusion over both rankings
+        fused = {}
+        for ranking in ([doc for doc, _ in lexical], vector_docs):
+            for rank, doc in enumerate(ranking):
+                entry = fused.setdefault(doc.page_content, [doc, 0.0])
+                entry[1] += 1.0 / (HYBRID_RRF_K + rank + 1)
+        ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+        return [doc for doc, _ in ranked[:self.k]]
+
+def create_retriever(file_path, file_id=None, on_stage=None):
     """Create retriever from file with improved configuration"""
     if not RAG_AVAILABLE:
         raise ValueError("RAG dependencies not available")
     
+    on_stage = on_stage or (lambda stage: None)
     try:
-        splits = document_loader_universal(file_path)
-        chunks = text_splitter(splits)
-        vectordb = vector_database(chunks)
+        # Pages flow lazily through the splitter into batched embedding, so
+        # only a page and one batch of chunks are in memory at a time
+        progress = {"file_metadata": None, "chunks": 0}
+        lexical_index = BM25Index() if HYBRID_RETRIEVAL else None
+        timings = {"load": 0.0, "load_and_split": 0.0}
         
-        max_chunks = len(chunks)
-        k = min(4, max_chunks)
+        def pages():
+            for page in timed_iter(iter_document_pages(file_path), timings, "load"):
+                if progress["file_metadata"] is None:
+                    progress["file_metadata"] = page.metadata
+                    if file_id:
+                        document_table.put(file_id, document_fields(page.metadata))
+                yield page
+            on_stage("loaded")
         
-        retriever = vectordb.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": k}
-        )
-        print(f"✅ Created retriever with k={k} (max available: {max_chunks})")
-        return retriever, splits[0].metadata if splits else {}
+        def chunks():
+            for chunk in timed_iter(iter_chunks(pages()), timings, "load_and_split"):
+                progress["chunks"] += 1
+                if file_id:
+                    # Per-file metadata lives in the document table, not on chunks
+                    chunk.metadata = compact_chunk_metadata(chunk.metadata, file_id)
+                if lexical_index is not None:
+                    lexical_index.add(chunk)
+                yield chunk
+            on_stage("split")
+        
+        collection = index_info(file_id).get("collection") if file_id else None
+        if collection:
+            vectordb = add_to_collection(collection, file_id, chunks())
+            metadata_filter = {"file_id": file_id}
+        elif RAG_PERSIST and file_id:
+            vectordb = vector_database_persistant(chunks(), file_id)
+            metadata_filter = None
+        else:
+            vectordb = vector_database(chunks(), f"file_{file_id}" if file_id else None, file_id)
+            metadata_filter = None
+        on_stage("embedded")
+        record_stage("load", timings["load"])
+        record_stage("split", timings["load_and_split"] - timings["load"])
+        
+        max_chunks = progress["chunks"]
+        retriever = _make_retriever(vectordb, max_chunks, metadata_filter, lexical_index)
+        return retriever, progress["file_metadata"] or {}, max_chunks
     except Exception as e:
         print(f"❌ Error creating retriever: {e}")
         raise
 
-def retriever_qa(file_path, query):
+def _make_retriever(vectordb, max_chunks, metadata_filter=None, lexical_index=None):
+    """Wrap a vector store in a similarity retriever sized to its chunk count"""
+    k = min(CONTEXT_CANDIDATES, max_chunks)
+    if HYBRID_RETRIEVAL:
+        if lexical_index is None:
+            lexical_index = BM25Index.from_store(vectordb, metadata_filter)
+        print(f"✅ Created hybrid BM25 + vector retriever with k={k} (max available: {max_chunks})")
+        return HybridRetriever(
+            vector_store=vectordb,
+            lexical_index=lexical_index,
+            k=k,
+            metadata_filter=metadata_filter
+        )
+    
+    search_kwargs = {"k": k}
+    if metadata_filter:
+        search_kwargs["filter"] = metadata_filter
+    
+    retriever = vectordb.as_retriever(
+        search_type="similarity",
+        search_kwargs=search_kwargs
+    )
+    print(f"✅ Created retriever with k={k} (max available: {max_chunks})")
+    return retriever
+
+def open_persisted_retriever(index_id):
+    """Reopen an index's persisted collection, or return None if there is none"""
+    file_info = index_info(index_id)
+    collection = file_info.get("collection")
+    if collection and file_info.get("indexed") and file_info.get("chunk_count"):
+        # Chunks already live in the shared collection index
+        vectordb = get_collection_store(collection)
+        retriever = _make_retriever(vectordb, file_info["chunk_count"], {"file_id": index_id})
+        return retriever, document_table.get(index_id) or file_info.get("file_metadata", {}), file_info["chunk_count"]
+    
+    persist_dir = VECTOR_DB_DIR / index_id
+    if not (RAG_PERSIST and file_info.get("indexed") and persist_dir.exists()):
+        return None
+    
+    try:
+        vectordb = Chroma(
+            collection_name=f"file_{index_id}",
+            embedding_function=cached_embedding(),
+            collection_metadata={"hnsw:space": "cosine"},
+            persist_directory=str(persist_dir)
+        )
+        max_chunks = file_info.get("chunk_count") or vectordb._collection.count()
+        if not max_chunks:
+            return None
+        print(f"📂 Reopened persisted vector database at {persist_dir}")
+        file_metadata = document_table.get(index_id) or file_info.get("file_metadata", {})
+        return _make_retriever(vectordb, max_chunks), file_metadata, max_chunks
+    except Exception as e:
+        print(f"⚠️  Could not reopen persisted vector database, rebuilding: {e}")
+        return None
+
+# === COLLECTIONS ===
+# Files uploaded with a collection name share one Chroma index, with each chunk
+# tagged by its file_id. A single similarity search (optionally filtered to a
+# subset of file_ids) then covers every document in the collection, instead of
+# one index build and one retrieval per file.
+# Chroma names must be 3-63 characters that start and end alphanumeric; with
+# the "collection_" prefix that leaves up to 52 characters for the name.
+COLLECTION_NAME_PATTERN = re.compile(r'^[A-Za-z0-9](?:[A-Za-z0-9_-]{0,50}[A-Za-z0-9])?$')
+MULTI_DOC_K = int(os.getenv('RAG_MULTI_DOC_K', '6'))
+
+collection_stores = {}
+collection_lock = threading.Lock()
+
+def get_collection_store(name):
+    """Open (or create) the shared vector store for a named collection"""
+    with collection_lock:
+        vectordb = collection_stores.get(name)
+        if vectordb is None:
+            kwargs = {}
+            if RAG_PERSIST:
+                persist_dir = VECTOR_DB_DIR / "collections" / name
+                persist_dir.mkdir(parents=True, exist_ok=True)
+                kwargs["persist_directory"] = str(persist_dir)
+            vectordb = Chroma(
+                collection_name=f"collection_{name}",
+                embedding_function=cached_embedding(),
+                collection_metadata={"hnsw:space": "cosine"},
+                **kwargs
+            )
+            collection_stores[name] = vectordb
+            print(f"📚 Opened collection '{name}'")
+        return vectordb
+
+def add_to_collection(name, file_id, chunks):
+    """Index a file's chunks into a collection, tagged with its file_id"""
+    vectordb = get_collection_store(name)
+    # Chunks from an earlier build of the same file are reused or removed
+    existing_ids = existing_chunk_ids(vectordb, {"file_id": file_id})
+    
+    def tagged(chunks):
+        for chunk in chunks:
+            chunk.metadata["file_id"] = file_id
+            yield chunk
+    
+    count = add_in_batches(vectordb, tagged(chunks), id_prefix=file_id, existing_ids=existing_ids)
+    print(f"✅ Added {count} chunks to collection '{name}'")
+    return vectordb
+
+def remove_from_collection(name, file_id):
+    """Delete every chunk belonging to file_id from a collection"""
+    try:
+        get_collection_store(name)._collection.delete(where={"file_id": file_id})
+    except Exception as e:
+        print(f"⚠️  Could not remove {file_id} from collection '{name}': {e}")
+
+def retrieve_across(file_ids, query, k=MULTI_DOC_K):
+    """Top-k chunks for query across several files with one query embedding"""
+    query_vector = watsonx_embedding().embed_query(query)
+    
+    # One search per shared collection, filtered to the requested files, plus
+    # one per file that still has its own index. Files sharing an index are
+    # searched once, under the first of them that was asked for.
+    by_index = {}
+    for file_id in file_ids:
+        by_index.setdefault(index_id_of(file_id), file_id)
+    by_collection = {}
+    single_files = []
+    for index_id, file_id in by_index.items():
+        collection = uploaded_files[file_id].get("collection")
+        if collection:
+            by_collection.setdefault(collection, []).append(index_id)
+        else:
+            single_files.append(file_id)
+    
+    scored = []
+    for collection, ids in by_collection.items():
+        metadata_filter = {"file_id": ids[0]} if len(ids) == 1 else {"file_id": {"$in": ids}}
+        for doc, score in get_collection_store(collection).similarity_search_by_vector_with_relevance_scores(
+            query_vector, k=k, filter=metadata_filter
+        ):
+            # Chunks are tagged with their index; report the requested file
+            doc.metadata["file_id"] = by_index.get(doc.metadata.get("file_id"), doc.metadata.get("file_id"))
+            scored.append((doc, score))
+    for file_id in single_files:
+        retriever_obj, _ = get_retriever(file_id, uploaded_files[file_id]["file_path"])
+        for doc, score in retriever_obj.vectorstore.similarity_search_by_vector_with_relevance_scores(
+            query_vector, k=k
+        ):
+            doc.metadata["file_id"] = file_id
+            scored.append((doc, score))
+    
+    # Scores are cosine distances, so lower is better
+    scored.sort(key=lambda pair: pair[1])
+    return [doc for doc, _ in scored[:k]]
+
+# === SHARED INDEXES ===
+# Uploads are deduplicated by content hash: an upload identical to one already
+# indexed in the same collection gets its own file_id but points at the
+# existing index (its "index_id") instead of being stored and embedded again.
+# Retrievers, collection chunk tags, vector_db/ directories and the stored file
+# are all keyed by index_id, and an index is dropped when the last upload
+# referencing it is deleted.
+def index_id_of(file_id):
+    """The index an upload reads from (its own file_id unless deduplicated)"""
+    return uploaded_files.get(file_id, {}).get("index_id", file_id)
+
+def index_refs(index_id):
+    """file_ids of the uploads sharing index_id"""
+    return [
+        file_id for file_id, file_info in list(uploaded_files.items())
+        if file_info.get("index_id", file_id) == index_id
+    ]
+
+def index_info(index_id):
+    """File info of an upload referencing index_id, or {} if none is left"""
+    for file_id in index_refs(index_id):
+        return uploaded_files.get(file_id, {})
+    return {}
+
+def find_duplicate_index(content_hash, collection, exclude=None):
+    """index_id of an upload with identical content in the same collection, if any"""
+    for file_id, file_info in list(uploaded_files.items()):
+        if (
+            file_id != exclude
+            and file_info.get("content_hash") == content_hash
+            and file_info.get("collection") == collection
+            and file_info.get("status") != "failed"
+            and Path(file_info["file_path"]).exists()
+        ):
+            return file_info.get("index_id", file_id)
+    return None
+
+def release_index(index_id, file_info):
+    """Drop an index no upload references any more, with its stored file"""
+    evict_retriever(index_id)
+    if file_info.get("collection") and RAG_AVAILABLE:
+        remove_from_collection(file_info["collection"], index_id)
+    document_table.delete(index_id)
+    Path(file_info["file_path"]).unlink(missing_ok=True)
+    count_event("indexes_released")
+    print(f"🗑️  Released index {index_id}")
+
+# === RETRIEVER CACHE ===
+# Retrievers are built once (at upload time) and reused by every query for the
+# same index_id. Entries are dropped on delete, or least-recently-used first once
+# the cache holds too many files or too many chunks in total (a rough proxy for
+# the memory held by the in-process Chroma collections).
+RETRIEVER_CACHE_MAX_FILES = int(os.getenv('RAG_RETRIEVER_CACHE_MAX_FILES', '32'))
+RETRIEVER_CACHE_MAX_CHUNKS = int(os.getenv('RAG_RETRIEVER_CACHE_MAX_CHUNKS', '20000'))
+
+retriever_cache = OrderedDict()
+retriever_cache_lock = threading.Lock()
+retriever_build_locks = {}
+
+def _release_retriever(entry, drop_index=False):
+    """Free the Chroma collection behind a cached retriever"""
+    if entry.get("shared"):
+        # Shared collection indexes are managed by remove_from_collection()
+        return
+    if RAG_PERSIST and not drop_index:
+        # Persisted collections stay on disk and are reopened on demand
+        return
+    try:
+        entry["retriever"].vectorstore.delete_collection()
+    except Exception as e:
+        print(f"⚠️  Could not release vector collection: {e}")
+
+def cache_retriever(file_id, retriever, file_metadata, chunk_count, shared=False):
+    """Store a retriever for file_id and evict LRU entries over budget"""
+    evicted = []
+    with retriever_cache_lock:
+        if file_id in retriever_cache:
+            evicted.append(retriever_cache.pop(file_id))
+        retriever_cache[file_id] = {
+            "retriever": retriever,
+            "file_metadata": file_metadata,
+            # Shared collections are not freed on eviction, so they don't count
+            "chunk_count": 0 if shared else chunk_count,
+            "shared": shared,
+        }
+        total_chunks = sum(entry["chunk_count"] for entry in retriever_cache.values())
+        while len(retriever_cache) > 1 and (
+            len(retriever_cache) > RETRIEVER_CACHE_MAX_FILES
+            or total_chunks > RETRIEVER_CACHE_MAX_CHUNKS
+        ):
+            old_id, entry = retriever_cache.popitem(last=False)
+            total_chunks -= entry["chunk_count"]
+            evicted.append(entry)
+            print(f"♻️  Evicted cached retriever for {old_id}")
+    
+    for entry in evicted:
+        if entry["retriever"] is not retriever:
+            _release_retriever(entry)
+
+def get_cached_retriever(file_id):
+    """Return the cached (retriever, file_metadata) for file_id, or None"""
+    with retriever_cache_lock:
+        entry = retriever_cache.get(file_id)
+        if entry is None:
+            return None
+        retriever_cache.move_to_end(file_id)
+        return entry["retriever"], entry["file_metadata"]
+
+def evict_retriever(index_id):
+    """Drop the cached retriever for index_id, if any"""
+    with retriever_cache_lock:
+        entry = retriever_cache.pop(index_id, None)
+        retriever_build_locks.pop(index_id, None)
+    if entry is not None:
+        _release_retriever(entry, drop_index=True)
+        print(f"🗑️  Evicted cached retriever for {index_id}")
+    
+    persist_dir = VECTOR_DB_DIR / index_id
+    if persist_dir.exists():
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+def get_retriever(file_id, file_path, on_stage=None, rebuild=False):
+    """Return the retriever for file_id, building and caching it on a miss"""
+    # Uploads sharing an index share its cached retriever too
+    index_id = index_id_of(file_id)
+    
+    # rebuild=True brings the index up to date with the file on disk even when
+    # a retriever is cached (ingestion, including re-uploads)
+    cached = None if rebuild else get_cached_retriever(index_id)
+    if cached is not None:
+        print(f"⚡ Reusing cached retriever for {index_id}")
+        count_event("cache_hits", cache="retriever")
+        return cached
+    count_event("cache_misses", cache="retriever")
+    
+    # One build per index even if several queries miss at the same time
+    with retriever_cache_lock:
+        build_lock = retriever_build_locks.setdefault(index_id, threading.Lock())
+    with build_lock:
+        if rebuild:
+            # The index is updated in place, so the old entry must not free it
+            with retriever_cache_lock:
+                retriever_cache.pop(index_id, None)
+        cached = get_cached_retriever(index_id)
+        if cached is not None:
+            return cached
+        
+        collection = index_info(index_id).get("collection")
+        reopened = None if rebuild else open_persisted_retriever(index_id)
+        if reopened is not None:
+            retriever, file_metadata, chunk_count = reopened
+        else:
+            retriever, file_metadata, chunk_count = create_retriever(file_path, index_id, on_stage)
+            refs = index_refs(index_id)
+            for ref_id in refs:
+                uploaded_files[ref_id].update({
+                    "indexed": RAG_PERSIST or bool(collection),
+                    "chunk_count": chunk_count,
+                    "file_metadata": file_metadata
+                })
+            if refs:
+                save_file_registry()
+        
+        cache_retriever(index_id, retriever, file_metadata, chunk_count, shared=bool(collection))
+        return retriever, file_metadata
+
+# === ANSWER CACHE ===
+# Users ask the same few questions of the same document over and over, so
+# answers are cached per (file_id, normalized query) and served without
+# touching the retriever or the LLM. With RAG_ANSWER_CACHE_SIMILARITY set
+# (e.g. 0.95), a question whose embedding is at least that similar to a cached
+# question for the same file also counts as a hit.
+ANSWER_CACHE_SIZE = int(os.getenv('RAG_ANSWER_CACHE_SIZE', '512'))
+ANSWER_CACHE_TTL = float(os.getenv('RAG_ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_SIMILARITY = float(os.getenv('RAG_ANSWER_CACHE_SIMILARITY', '0'))
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r'\s+', ' ', query.strip().lower()).rstrip(' ?!.')
+
+def _cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class AnswerCache:
+    """Size- and TTL-bounded LRU of answers keyed by (file_id, normalized query)"""
+    
+    def __init__(self, max_entries, ttl, similarity):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+    
+    def _query_vector(self, query):
+        if self.similarity <= 0:
+            return None
+        try:
+            return watsonx_embedding().embed_query(query)
+        except Exception as e:
+            print(f"⚠️  Could not embed query for answer cache: {e}")
+            return None
+    
+    def get(self, file_id, query):
+        """Return (answer, file_metadata, query_vector); answer is None on a miss"""
+        key = (file_id, normalize_query(query))
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires"] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                count_event("cache_hits", cache="answer")
+                return entry["answer"], entry["file_metadata"], None
+        
+        vector = self._query_vector(query)
+        if vector is not None:
+            with self.lock:
+                best_key, best_score = None, self.similarity
+                for other_key, entry in self.entries.items():
+                    if other_key[0] != file_id or entry["vector"] is None or entry["expires"] <= now:
+                        continue
+                    score = _cosine_similarity(vector, entry["vector"])
+                    if score >= best_score:
+                        best_key, best_score = other_key, score
+                if best_key is not None:
+                    entry = self.entries[best_key]
+                    self.entries.move_to_end(best_key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    count_event("cache_hits", cache="answer_semantic")
+                    return entry["answer"], entry["file_metadata"], vector
+        
+        with self.lock:
+            self.misses += 1
+        count_event("cache_misses", cache="answer")
+        return None, None, vector
+    
+    def put(self, file_id, query, answer, file_metadata, vector=None):
+        key = (file_id, normalize_query(query))
+        with self.lock:
+            self.entries[key] = {
+                "answer": answer,
+                "file_metadata": file_metadata,
+                "vector": vector,
+                "expires": time.time() + self.ttl
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, scope):
+        """Forget cached answers for a file (including multi-file answers) or scope"""
+        with self.lock:
+            stale = [
+                key for key in self.entries
+                if key[0] == scope or scope in key[0].split(":", 1)[-1].split(",")
+            ]
+            for key in stale:
+                del self.entries[key]
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses
+            }
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY)
+
+# === CONTEXT PACKING ===
+# Retrieval returns up to RAG_CONTEXT_CANDIDATES ranked chunks. They are packed
+# into the prompt best-first until RAG_CONTEXT_TOKEN_BUDGET (estimated) tokens
+# are used. Text repeated between neighbouring chunks by the splitter's overlap
+# is sent only once, and a chunk already contained in the context is dropped.
+CONTEXT_TOKEN_BUDGET = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '1200'))
+CONTEXT_CANDIDATES = int(os.getenv('RAG_CONTEXT_CANDIDATES', '8'))
+# Overlap shorter than this is too likely to be a coincidental match
+MIN_OVERLAP_CHARS = 40
+MAX_OVERLAP_CHARS = 400
+
+def _overlap(left, right):
+    """Length of the longest suffix of left that is also a prefix of right"""
+    longest = min(len(left), len(right), MAX_OVERLAP_CHARS)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def _strip_overlap(text, packed):
+    """Remove from text whatever the already packed chunks repeat"""
+    for other in packed:
+        if text in other:
+            return ""
+        size = _overlap(other, text)
+        if size:
+            text = text[size:]
+        size = _overlap(text, other)
+        if size:
+            text = text[:-size]
+    return text.strip()
+
+def _truncate_to_tokens(text, budget):
+    """Cut text to roughly budget tokens, at a word boundary when possible"""
+    limit = budget * 4
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > limit // 2 else limit]
+
+def pack_context(docs, budget=CONTEXT_TOKEN_BUDGET, label=None):
+    """Join ranked chunks into a deduplicated context within a token budget"""
+    packed = []
+    parts = []
+    used = 0
+    for doc in docs:
+        text = _strip_overlap(doc.page_content.strip(), packed)
+        if not text:
+            continue
+        part = f"[{label(doc)}]\n{text}" if label else text
+        # +1 for the blank line between parts
+        cost = estimate_tokens(part) + 1
+        if used + cost > budget:
+            if parts:
+                continue
+            # Always send something, even if the best chunk alone is too long
+            part = _truncate_to_tokens(part, budget)
+            cost = budget
+        packed.append(text)
+        parts.append(part)
+        used += cost
+    
+    count_event("context_chunks", len(parts), kind="packed")
+    count_event("context_chunks", len(docs) - len(parts), kind="dropped")
+    count_event("context_tokens", used)
+    return "\n\n".join(parts)
+
+def retriever_qa(file_path, query, file_id=None):
     """Main QA function with comprehensive error handling"""
     if not RAG_AVAILABLE:
         # Fallback to demo response
@@ -379,48 +2109,186 @@ def retriever_qa(file_path, query):
         
         print(f"🔍 Processing query: {query}")
         print(f"📎 File: {file_path}")
+        annotate_trace(file_id=file_id, query_chars=len(query))
+        
+        query_vector = None
+        if file_id:
+            cached_answer, file_metadata, query_vector = answer_cache.get(file_id, query)
+            if cached_answer is not None:
+                print("⚡ Answer served from cache")
+                return f"{cached_answer}{source_footer(file_metadata)}"
         
         # Initialize components
         llm = get_llm()
-        retriever_obj, file_metadata = create_retriever(file_path)
-        
-        # Create QA chain
-        qa = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=retriever_obj,
-            return_source_documents=False,
-            verbose=False
-        )
+        with stage_timer("retriever"):
+            if file_id:
+                retriever_obj, file_metadata = get_retriever(file_id, file_path)
+            else:
+                retriever_obj, file_metadata, _ = create_retriever(file_path)
         
-        # Use invoke method
-        try:
-            response = qa.invoke({"query": query})
-            result = response.get('result', response) if isinstance(response, dict) else response
-        except AttributeError:
-            response = qa({"query": query})
-            result = response['result']
-        
-        # Add file info to response
-        file_icon = file_metadata.get('file_icon', '📎')
-        source_file = file_metadata.get('source_file', 'document')
-        file_type = file_metadata.get('file_type', '').upper()
-        
-        # Get encouragement message
-        encouragement = get_encouragement()
+        # Same "stuff" prompt as RetrievalQA, with retrieval and generation
+        # run as separate steps so each can be timed
+        with stage_timer("retrieve"):
+            docs = retriever_obj.invoke(query)
+        count_event("retrieved_chunks", len(docs))
+        prompt = STUFF_PROMPT_TEMPLATE.format(context=pack_context(docs), question=query)
+        with stage_timer("generate"):
+            result = llm.invoke(prompt)
+        count_event("llm_tokens", estimate_tokens(prompt), kind="prompt")
+        count_event("llm_tokens", estimate_tokens(result), kind="completion")
+        
+        if file_id:
+            answer_cache.put(file_id, query, result, file_metadata, query_vector)
         
-        # Combine response
-        response_with_source = f"{result}\n\n---\n💡 *Source: {file_icon} {source_file} ({file_type})*\n\n🌟 {encouragement}"
+        # Combine response with file info and encouragement
+        response_with_source = f"{result}{source_footer(file_metadata)}"
         
         print("✅ Generated response successfully")
         return response_with_source
-        
+    
     except Exception as e:
         error_msg = f"Processing Error: {str(e)}"
         print(f"❌ {error_msg}")
+        annotate_trace(error=str(e))
         encouragement = get_encouragement()
         return f"Sorry, I encountered an error while processing your request.\n\nError details: {str(e)}\n\nPlease check your file and try again.\n\n🌟 {encouragement}"
 
+def source_footer(file_metadata):
+    """Source line and encouragement appended to every answer"""
+    file_icon = file_metadata.get('file_icon', '📎')
+    source_file = file_metadata.get('source_file', 'document')
+    file_type = file_metadata.get('file_type', '').upper()
+    encouragement = get_encouragement()
+    return f"\n\n---\n💡 *Source: {file_icon} {source_file} ({file_type})*\n\n🌟 {encouragement}"
+
+def sources_footer(file_ids):
+    """Footer listing every source document of a multi-document answer"""
+    sources = ", ".join(
+        f"{get_file_icon(uploaded_files[file_id]['file_extension'])} {uploaded_files[file_id]['original_name']}"
+        for file_id in file_ids if file_id in uploaded_files
+    )
+    encouragement = get_encouragement()
+    return f"\n\n---\n💡 *Sources: {sources}*\n\n🌟 {encouragement}"
+
+# Same prompt RetrievalQA's "stuff" chain uses, so streamed answers match /api/query
+STUFF_PROMPT_TEMPLATE = """Use the following pieces of context to answer the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+{context}
+
+Question: {question}
+Helpful Answer:"""
+
+def stream_tokens(llm, prompt):
+    """Yield LLM tokens, timing time-to-first-token and the whole generation"""
+    tokens = []
+    start = time.perf_counter()
+    for token in llm.stream(prompt):
+        if not tokens:
+            record_stage("first_token", time.perf_counter() - start)
+        tokens.append(token)
+        yield token
+    record_stage("generate", time.perf_counter() - start)
+    count_event("llm_tokens", estimate_tokens(prompt), kind="prompt")
+    count_event("llm_tokens", estimate_tokens("".join(tokens)), kind="completion")
+    return tokens
+
+def retriever_qa_stream(file_path, query, file_id=None):
+    """Streaming variant of retriever_qa that yields answer text as it is generated"""
+    if not RAG_AVAILABLE or not query or not query.strip():
+        yield retriever_qa(file_path, query, file_id)
+        return
+    
+    try:
+        print(f"🔍 Processing streamed query: {query}")
+        print(f"📎 File: {file_path}")
+        annotate_trace(file_id=file_id, query_chars=len(query))
+        
+        query_vector = None
+        if file_id:
+            cached_answer, file_metadata, query_vector = answer_cache.get(file_id, query)
+            if cached_answer is not None:
+                print("⚡ Answer served from cache")
+                yield cached_answer
+                yield source_footer(file_metadata)
+                return
+        
+        llm = get_llm()
+        with stage_timer("retriever"):
+            if file_id:
+                retriever_obj, file_metadata = get_retriever(file_id, file_path)
+            else:
+                retriever_obj, file_metadata, _ = create_retriever(file_path)
+        
+        with stage_timer("retrieve"):
+            docs = retriever_obj.invoke(query)
+        count_event("retrieved_chunks", len(docs))
+        prompt = STUFF_PROMPT_TEMPLATE.format(context=pack_context(docs), question=query)
+        
+        tokens = yield from stream_tokens(llm, prompt)
+        
+        if file_id:
+            answer_cache.put(file_id, query, "".join(tokens), file_metadata, query_vector)
+        yield source_footer(file_metadata)
+        print("✅ Streamed response successfully")
+    
+    except Exception as e:
+        error_msg = f"Processing Error: {str(e)}"
+        print(f"❌ {error_msg}")
+        annotate_trace(error=str(e))
+        encouragement = get_encouragement()
+        yield f"\n\nSorry, I encountered an error while processing your request.\n\nError details: {str(e)}\n\nPlease check your file and try again.\n\n🌟 {encouragement}"
+
+def retriever_qa_multi_stream(file_ids, query, scope):
+    """Answer a question from the top chunks across several files, streaming tokens"""
+    if not RAG_AVAILABLE:
+        encouragement = get_encouragement()
+        names = ", ".join(uploaded_files[file_id]["original_name"] for file_id in file_ids)
+        yield f"🤖 Demo Mode: I would analyze your documents ({names}) to answer: '{query}'\n\nTo enable real RAG processing, install: pip install langchain-ibm langchain-community chromadb ibm-watsonx-ai python-docx\n\n🌟 {encouragement}"
+        return
+    if not query or not query.strip():
+        yield "Please enter a question."
+        return
+    
+    try:
+        print(f"🔍 Processing query across {len(file_ids)} file(s): {query}")
+        
+        query_vector = None
+        cached_answer, _, query_vector = answer_cache.get(scope, query)
+        if cached_answer is not None:
+            print("⚡ Answer served from cache")
+            yield cached_answer
+            yield sources_footer(file_ids)
+            return
+        
+        annotate_trace(file_ids=file_ids, query_chars=len(query))
+        llm = get_llm()
+        with stage_timer("retrieve"):
+            docs = retrieve_across(file_ids, query)
+        count_event("retrieved_chunks", len(docs))
+        # Label each chunk with its document so the LLM can compare them
+        context = pack_context(
+            docs,
+            label=lambda doc: uploaded_files.get(doc.metadata.get('file_id'), {}).get('original_name', 'document')
+        )
+        prompt = STUFF_PROMPT_TEMPLATE.format(context=context, question=query)
+        
+        tokens = yield from stream_tokens(llm, prompt)
+        
+        answer_cache.put(scope, query, "".join(tokens), {}, query_vector)
+        yield sources_footer(file_ids)
+        print("✅ Generated multi-document response successfully")
+    
+    except Exception as e:
+        error_msg = f"Processing Error: {str(e)}"
+        print(f"❌ {error_msg}")
+        annotate_trace(error=str(e))
+        encouragement = get_encouragement()
+        yield f"\n\nSorry, I encountered an error while processing your request.\n\nError details: {str(e)}\n\nPlease check your files and try again.\n\n🌟 {encouragement}"
+
+def retriever_qa_multi(file_ids, query, scope):
+    """Non-streaming wrapper around retriever_qa_multi_stream"""
+    return "".join(retriever_qa_multi_stream(file_ids, query, scope))
+
 # === FASTAPI APP SETUP ===
 # Create FastAPI app
 app = FastAPI(title="RAG Document Q&A System", version="1.0.0")
@@ -446,6 +2314,26 @@ handler = logging.FileHandler('/var/log/FastAPI/uvicorn.access')
 handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
 access_logger.addHandler(handler)
 
+# One JSON object per query/ingestion job (see METRICS)
+if METRICS_JSON_LOG:
+    metrics_logger = logging.getLogger("rag.metrics")
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False
+    metrics_handler = logging.FileHandler(METRICS_LOG_FILE)
+    metrics_handler.setFormatter(logging.Formatter('%(message)s'))
+    metrics_logger.addHandler(metrics_handler)
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    """Time every request, labelled by route template rather than raw path"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    metrics.observe("rag_http_request_duration_seconds", time.perf_counter() - start, method=request.method, path=path)
+    metrics.inc("rag_http_requests_total", method=request.method, path=path, status=str(response.status_code))
+    return response
+
 # Serve static files (CSS, JS, HTML)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -456,17 +2344,243 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 # Store uploaded files info (in production, use a database)
 uploaded_files = {}
 
+# On-disk copy of uploaded_files, used when RAG_PERSIST is enabled
+REGISTRY_PATH = UPLOAD_DIR / "registry.json"
+registry_lock = threading.Lock()
+
+def save_file_registry():
+    """Write the upload registry to disk (no-op unless persistence is on)"""
+    if not RAG_PERSIST:
+        return
+    try:
+        with registry_lock:
+            tmp_path = REGISTRY_PATH.with_suffix(".json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(uploaded_files, f, indent=2, default=str)
+            os.replace(tmp_path, REGISTRY_PATH)
+    except Exception as e:
+        print(f"⚠️  Could not save file registry: {e}")
+
+def load_file_registry():
+    """Read the upload registry, skipping entries whose file has gone"""
+    if not REGISTRY_PATH.exists():
+        return {}
+    try:
+        with open(REGISTRY_PATH, "r", encoding="utf-8") as f:
+            registry = json.load(f)
+    except Exception as e:
+        print(f"⚠️  Could not read file registry: {e}")
+        return {}
+    return {
+        file_id: info for file_id, info in registry.items()
+        if Path(info.get("file_path", "")).exists()
+    }
+
+if RAG_PERSIST:
+    uploaded_files.update(load_file_registry())
+    print(f"📂 Restored {len(uploaded_files)} uploaded file(s) from {REGISTRY_PATH}")
+
 # Global RAG state
 rag_initialized = False
 
 class QueryRequest(BaseModel):
     query: str
-    file_id: str
+    # Query one file, an explicit list of files, or every file in a collection
+    file_id: Optional[str] = None
+    file_ids: Optional[List[str]] = None
+    collection: Optional[str] = None
 
 class QueryResponse(BaseModel):
     answer: str
     file_name: str
 
+# === BACKGROUND INGESTION ===
+# Uploads are saved and acknowledged immediately; loading, splitting and
+# embedding run on a bounded worker pool so a large PDF never blocks the event
+# loop. Progress is tracked per file in uploaded_files and exposed through
+# GET /api/files/{file_id}/status.
+INGEST_WORKERS = int(os.getenv('RAG_INGEST_WORKERS', '2'))
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+def ensure_rag_credentials():
+    """Load credentials if needed; return True when real RAG can run"""
+    global rag_initialized
+    if not RAG_AVAILABLE:
+        return False
+    if not (os.getenv('IBM_API_KEY') and os.getenv('IBM_PROJECT_ID')):
+        print("🔍 Credentials not in environment, loading them now...")
+        api_key, project_id = setup_credentials()
+        if not (api_key and project_id):
+            print("⚠️  No credentials available, using demo mode")
+            return False
+    # Credentials from the process environment count as much as ones from ~/.env
+    rag_initialized = True
+    return True
+
+def ensure_indexing_ready():
+    """Return True when uploads can be embedded and indexed"""
+    # Local embedding backends index without Watsonx; only answering needs it
+    if RAG_AVAILABLE and EMBEDDING_BACKEND != "watsonx":
+        return True
+    return ensure_rag_credentials()
+
+def set_ingest_stage(file_id, stage):
+    """Record the latest completed ingestion stage for a file"""
+    file_info = uploaded_files.get(file_id)
+    if file_info is not None:
+        file_info["stage"] = stage
+        print(f"📍 {file_info['original_name']}: {stage}")
+
+def ingest_document(file_id, rebuild=True):
+    """Load, split and index an uploaded file (runs on the ingest pool)"""
+    file_info = uploaded_files.get(file_id)
+    if file_info is None:
+        return
+    
+    file_info["status"] = "processing"
+    annotate_trace(file_id=file_id, file_type=file_info.get("file_extension"))
+    try:
+        if ensure_indexing_ready():
+            _, file_metadata = get_retriever(
+                file_id, file_info["file_path"],
+                on_stage=lambda stage: set_ingest_stage(file_id, stage),
+                rebuild=rebuild
+            )
+            file_info["file_metadata"] = file_metadata
+            set_ingest_stage(file_id, "indexed")
+            print(f"✅ Successfully processed {file_info['original_name']} for RAG")
+        elif RAG_AVAILABLE:
+            print(f"📋 File uploaded in demo mode: {file_info['original_name']}")
+        else:
+            print(f"📋 File uploaded in demo mode (RAG dependencies not available): {file_info['original_name']}")
+        file_info["status"] = "ready"
+    
+    except Exception as processing_error:
+        print(f"⚠️  RAG processing failed: {processing_error}")
+        annotate_trace(error=str(processing_error))
+        file_info["status"] = "failed"
+        file_info["processing_error"] = str(processing_error)
+    
+    # Mark as processed even on failure so the file can still be queried
+    file_info["processed"] = True
+    
+    if file_id in uploaded_files:
+        if file_info.get("collection"):
+            # The collection now has new content to answer from
+            answer_cache.invalidate(f"collection:{file_info['collection']}")
+        save_file_registry()
+    else:
+        # Deleted while it was being ingested
+        index_id = file_info.get("index_id", file_id)
+        if not index_refs(index_id):
+            release_index(index_id, file_info)
+
+def queue_ingestion(file_id, rebuild=True):
+    """Schedule a file for background ingestion"""
+    # rebuild=False only attaches the upload to an index that already exists
+    uploaded_files[file_id]["status"] = "queued"
+    ingest_executor.submit(run_traced, "ingest", ingest_document, file_id, rebuild)
+
+# === QUERY WORKER POOL ===
+# Retrieval and LLM calls are blocking, so queries run on their own thread pool
+# rather than on the event loop. At most RAG_QUERY_WORKERS run at once and up to
+# RAG_QUERY_MAX_PENDING more may wait; beyond that requests get a 503 with
+# Retry-After instead of piling up behind Watsonx.
+QUERY_WORKERS = int(os.getenv('RAG_QUERY_WORKERS', '4'))
+QUERY_MAX_PENDING = int(os.getenv('RAG_QUERY_MAX_PENDING', '16'))
+query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+queries_in_flight = 0
+
+def run_traced(operation, func, *args):
+    """Call func inside a metrics trace (on the worker thread that runs it)"""
+    with traced(operation):
+        return func(*args)
+
+async def run_query_job(func, *args):
+    """Run blocking RAG work on the query pool, rejecting it when saturated"""
+    global queries_in_flight
+    if queries_in_flight >= QUERY_WORKERS + QUERY_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy answering other questions, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    
+    queries_in_flight += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(query_executor, run_traced, "query", func, *args)
+    finally:
+        queries_in_flight -= 1
+
+async def stream_query_job(func, *args):
+    """Iterate a blocking generator on the query pool, yielding its items"""
+    global queries_in_flight
+    if queries_in_flight >= QUERY_WORKERS + QUERY_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy answering other questions, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+    done = object()
+    
+    def produce():
+        try:
+            with traced("query_stream"):
+                for item in func(*args):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+    
+    def release(_):
+        global queries_in_flight
+        queries_in_flight -= 1
+    
+    # The slot is freed when the worker finishes, not by the generator: a
+    # client disconnect cancels the response task, and a cancelled task never
+    # gets past an await in consume()'s finally (or may never start consume())
+    queries_in_flight += 1
+    worker = loop.run_in_executor(query_executor, produce)
+    worker.add_done_callback(release)
+    
+    async def consume():
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop generating if the client went away
+            cancelled.set()
+    
+    return consume()
+
+# Resume ingestion interrupted by a restart
+for _file_id, _file_info in list(uploaded_files.items()):
+    if not _file_info.get("processed"):
+        queue_ingestion(_file_id)
+
+@app.on_event("startup")
+async def warm_up():
+    """Load credentials and build Watsonx clients before the first request"""
+    if RAG_AVAILABLE:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(query_executor, ensure_rag_credentials)
+        loop.run_in_executor(query_executor, warm_up_clients)
+        # Compact chunk metadata of indexes from before the document table
+        loop.run_in_executor(ingest_executor, migrate_vector_db)
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
     """Serve the main HTML page"""
@@ -476,42 +2590,218 @@ async def read_root():
     except FileNotFoundError:
         return HTMLResponse(content="<h1>Please make sure index.html is in the static/ directory</h1>")
 
+# === STREAMING UPLOADS ===
+# Uploads are parsed straight off the request body instead of going through
+# Starlette's spooled UploadFile. File data is hashed and written to a partial
+# file in UPLOAD_DIR as it arrives, then renamed into place. The event loop
+# never blocks on a full copy. Files over RAG_MAX_UPLOAD_MB are rejected with
+# 413, up front when Content-Length already says so, otherwise as soon as
+# the stream crosses the limit.
+MAX_UPLOAD_BYTES = int(float(os.getenv('RAG_MAX_UPLOAD_MB', '25')) * 1024 * 1024)
+# Room for multipart boundaries, headers and small form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+ALLOWED_UPLOAD_TYPES = {
+    "application/pdf": ".pdf",
+    "application/msword": ".doc",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "text/plain": ".txt"
+}
+
+def validate_upload_type(filename, content_type):
+    """Reject unsupported files as soon as the part headers arrive"""
+    # Check file extension as fallback
+    file_extension = Path(filename).suffix.lower()
+    if content_type not in ALLOWED_UPLOAD_TYPES and file_extension not in ['.pdf', '.doc', '.docx', '.txt']:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type. Allowed types: PDF, DOC, DOCX, TXT"
+        )
+
+class StreamedUpload:
+    """A file part written to disk while the request was being received"""
+    
+    def __init__(self, partial_path):
+        self.partial_path = partial_path
+        self.filename = None
+        self.content_type = None
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.fields = {}
+    
+    @property
+    def content_hash(self):
+        return self.digest.hexdigest()
+    
+    def discard(self):
+        if self.partial_path.exists():
+            self.partial_path.unlink()
+
+def _disposition_params(headers):
+    _, params = parse_options_header(headers.get(b"content-disposition", b""))
+    return {key.decode("latin-1"): value.decode("utf-8", "replace") for key, value in params.items()}
+
+async def receive_upload(request, validate=None):
+    """Stream a multipart upload's "file" part to disk; returns a StreamedUpload"""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
+    
+    upload = StreamedUpload(UPLOAD_DIR / f".{uuid.uuid4().hex}.part")
+    part = {"headers": {}, "field": b"", "value": b"", "is_file": False}
+    pending = []
+    
+    def on_part_begin():
+        part.update(headers={}, field=b"", value=b"", is_file=False)
+    
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+    
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+    
+    def on_headers_finished():
+        disposition = _disposition_params(part["headers"])
+        part["name"] = disposition.get("name")
+        part["data"] = []
+        if part["name"] == "file" and "filename" in disposition:
+            if upload.filename is not None:
+                raise HTTPException(status_code=400, detail="Only one file may be uploaded at a time")
+            part["is_file"] = True
+            upload.filename = disposition["filename"]
+            upload.content_type = part["headers"].get(b"content-type", b"").decode("latin-1") or None
+            if validate:
+                validate(upload.filename, upload.content_type)
+    
+    def on_part_data(data, start, end):
+        if not part["is_file"]:
+            part["data"].append(data[start:end])
+            if sum(len(block) for block in part["data"]) > MULTIPART_OVERHEAD_BYTES:
+                raise HTTPException(status_code=400, detail="Form field too large")
+            return
+        block = bytes(data[start:end])
+        upload.size += len(block)
+        if upload.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)")
+        upload.digest.update(block)
+        pending.append(block)
+    
+    def on_part_end():
+        if not part["is_file"] and part.get("name"):
+            upload.fields[part["name"]] = b"".join(part["data"]).decode("utf-8", "replace")
+    
+    parser = MultipartParser(params[b"boundary"], callbacks={
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    
+    loop = asyncio.get_running_loop()
+    try:
+        with open(upload.partial_path, "wb") as buffer:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if pending:
+                    blocks = b"".join(pending)
+                    pending.clear()
+                    await loop.run_in_executor(None, buffer.write, blocks)
+            parser.finalize()
+    except Exception:
+        upload.discard()
+        raise
+    
+    if upload.filename is None:
+        upload.discard()
+        raise HTTPException(status_code=400, detail="No file was uploaded")
+    return upload
+
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(request: Request):
     """Handle file upload and RAG processing"""
     
-    # Validate file type
-    allowed_types = {
-        "application/pdf": ".pdf",
-        "application/msword": ".doc", 
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
-        "text/plain": ".txt"
-    }
+    # The file is validated, hashed and written to disk while it streams in
+    file = await receive_upload(request, validate=validate_upload_type)
     
-    # Check file extension as fallback
-    file_extension = Path(file.filename).suffix.lower()
-    if file.content_type not in allowed_types and file_extension not in ['.pdf', '.doc', '.docx', '.txt']:
+    collection = file.fields.get("collection") or None
+    if collection is not None and not COLLECTION_NAME_PATTERN.match(collection):
+        file.discard()
         raise HTTPException(
-            status_code=400, 
-            detail=f"Unsupported file type. Allowed types: PDF, DOC, DOCX, TXT"
+            status_code=400,
+            detail="Collection names may only contain letters, digits, '-' and '_', "
+                   "must start and end with a letter or digit, and are at most 52 characters"
         )
     
-    # Generate unique file ID
-    file_id = str(uuid.uuid4())
-    
     # Determine file extension
-    if file.content_type in allowed_types:
-        file_extension = allowed_types[file.content_type]
+    if file.content_type in ALLOWED_UPLOAD_TYPES:
+        file_extension = ALLOWED_UPLOAD_TYPES[file.content_type]
     else:
         file_extension = Path(file.filename).suffix.lower()
     
-    # Create file path
-    file_path = UPLOAD_DIR / f"{file_id}{file_extension}"
+    # An upload with a "replace" field naming an existing file_id updates that
+    # upload in place: it keeps its file_id and only changed chunks are
+    # re-embedded. Otherwise generate a unique file ID. Only a client that
+    # knows the file_id can replace it; matching by filename would let one
+    # user overwrite another user's "resume.pdf".
+    previous_id = file.fields.get("replace") or None
+    previous = uploaded_files.get(previous_id) if previous_id else None
+    if previous_id and previous is None:
+        file.discard()
+        raise HTTPException(status_code=404, detail="File to replace not found")
+    if previous and "collection" not in file.fields:
+        collection = previous.get("collection")
+    elif previous and previous.get("collection") != collection:
+        file.discard()
+        raise HTTPException(status_code=400, detail="A replacement must stay in the same collection")
+    file_id = previous_id or str(uuid.uuid4())
     
     try:
-        # Save file to disk
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        content_hash = file.content_hash
+        if previous and previous.get("content_hash") == content_hash and previous.get("status") != "failed":
+            file.discard()
+            print(f"⚡ {file.filename} is unchanged, keeping index for {file_id}")
+            return upload_response(file_id, file.filename, ensure_rag_credentials(), unchanged=True)
+        
+        # Identical content that is already indexed is shared, not re-embedded.
+        # A re-upload that is the sole user of its index updates it in place;
+        # one whose old index is still shared moves to an index of its own.
+        old_index = index_id_of(file_id) if previous else None
+        duplicate = find_duplicate_index(content_hash, collection, exclude=file_id)
+        if duplicate:
+            index_id = duplicate
+        elif previous and index_refs(old_index) == [file_id]:
+            index_id = old_index
+        else:
+            index_id = file_id if not index_refs(file_id) else str(uuid.uuid4())
+        
+        # Create file path; the upload sits under a temporary name until here, so
+        # an unchanged re-upload leaves the original untouched
+        if duplicate:
+            shared = index_info(duplicate)
+            file_path = Path(shared["file_path"])
+            file.discard()
+            print(f"♻️  {file.filename} is identical to an indexed upload, sharing index {index_id}")
+            count_event("uploads_deduplicated")
+        else:
+            shared = None
+            file_path = UPLOAD_DIR / f"{index_id}{file_extension}"
+            if previous and index_id == old_index and previous["file_path"] != str(file_path):
+                Path(previous["file_path"]).unlink(missing_ok=True)
+            os.replace(file.partial_path, file_path)
+        if previous:
+            print(f"🔁 {file.filename} changed, re-indexing {file_id}")
+            answer_cache.invalidate(file_id)
         
         # Store file info
         uploaded_files[file_id] = {
@@ -520,71 +2810,88 @@ async def upload_file(file: UploadFile = File(...)):
             "content_type": file.content_type,
             "file_extension": file_extension,
             "processed": False,
-            "processing_error": None
+            "processing_error": None,
+            "status": "queued",
+            "stage": "saved",
+            "collection": collection,
+            "content_hash": content_hash,
+            "size_bytes": file.size,
+            "index_id": index_id
         }
+        if shared:
+            for key in ("indexed", "chunk_count", "file_metadata"):
+                if key in shared:
+                    uploaded_files[file_id][key] = shared[key]
+        if previous and old_index != index_id and not index_refs(old_index):
+            release_index(old_index, previous)
+        save_file_registry()
         
-        # Process document for RAG - but ensure credentials are loaded first
-        try:
-            if RAG_AVAILABLE:
-                # CRITICAL FIX: Always ensure credentials are loaded before RAG processing
-                if not (os.getenv('IBM_API_KEY') and os.getenv('IBM_PROJECT_ID')):
-                    print("🔍 Credentials not in environment, loading them now...")
-                    api_key, project_id = setup_credentials()
-                    if not (api_key and project_id):
-                        print("⚠️  No credentials available, using demo mode")
-                        # Don't modify rag_initialized here since it's global
-                    else:
-                        # Credentials are set by setup_credentials()
-                        global rag_initialized
-                        rag_initialized = True
-                
-                if rag_initialized and os.getenv('IBM_API_KEY') and os.getenv('IBM_PROJECT_ID'):
-                    # Test if we can create retriever (this validates the document)
-                    _, file_metadata = create_retriever(str(file_path))
-                    uploaded_files[file_id]["processed"] = True
-                    uploaded_files[file_id]["file_metadata"] = file_metadata
-                    print(f"✅ Successfully processed {file.filename} for RAG")
-                else:
-                    uploaded_files[file_id]["processed"] = True  # Mark as processed for demo mode
-                    print(f"📋 File uploaded in demo mode: {file.filename}")
-            else:
-                uploaded_files[file_id]["processed"] = True  # Mark as processed for demo mode
-                print(f"📋 File uploaded in demo mode (RAG dependencies not available): {file.filename}")
-                
-        except Exception as processing_error:
-            print(f"⚠️  RAG processing failed: {processing_error}")
-            uploaded_files[file_id]["processed"] = True  # Still allow querying
-            uploaded_files[file_id]["processing_error"] = str(processing_error)
-        
-        file_icon = get_file_icon(file_extension)
-        
-        return JSONResponse({
-            "status": "success",
-            "message": f"File '{file.filename}' uploaded successfully!",
-            "file_id": file_id,
-            "file_name": file.filename,
-            "file_icon": file_icon,
-            "rag_available": RAG_AVAILABLE and rag_initialized,
-            "processing_error": uploaded_files[file_id].get("processing_error")
-        })
-        
+        # Check credentials now so the response reports the right mode, then
+        # hand loading/splitting/embedding to the ingest pool
+        rag_ready = ensure_rag_credentials()
+        queue_ingestion(file_id, rebuild=not duplicate)
+        return upload_response(file_id, file.filename, rag_ready, reindexed=previous is not None)
+    
     except Exception as e:
         # Clean up file if something went wrong
-        if file_path.exists():
-            file_path.unlink()
+        file.discard()
         raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
 
+def upload_response(file_id, file_name, rag_ready, unchanged=False, reindexed=False):
+    file_info = uploaded_files[file_id]
+    return JSONResponse({
+        "status": "success",
+        "message": f"File '{file_name}' is unchanged, nothing to re-index." if unchanged
+                   else f"File '{file_name}' uploaded successfully!",
+        "file_id": file_id,
+        "job_id": file_id,
+        "file_name": file_name,
+        "file_icon": get_file_icon(file_info["file_extension"]),
+        "collection": file_info.get("collection"),
+        "rag_available": rag_ready,
+        "unchanged": unchanged,
+        "reindexed": reindexed,
+        "shared_index": len(index_refs(file_info.get("index_id", file_id))) > 1,
+        "processing_status": file_info["status"],
+        "status_url": f"/api/files/{file_id}/status",
+        "processing_error": file_info.get("processing_error")
+    })
+
+def resolve_query_files(request):
+    """Validate a query's target; return (file_ids, answer cache scope or None)"""
+    targets = [bool(request.file_id), bool(request.file_ids), bool(request.collection)]
+    if sum(targets) != 1:
+        raise HTTPException(status_code=400, detail="Provide exactly one of file_id, file_ids or collection")
+    
+    if request.collection:
+        file_ids = sorted(
+            file_id for file_id, info in uploaded_files.items()
+            if info.get("collection") == request.collection
+        )
+        if not file_ids:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        scope = f"collection:{request.collection}"
+    elif request.file_ids:
+        file_ids = sorted(set(request.file_ids))
+        scope = f"files:{','.join(file_ids)}"
+    else:
+        file_ids = [request.file_id]
+        scope = None
+    
+    for file_id in file_ids:
+        if file_id not in uploaded_files:
+            raise HTTPException(status_code=404, detail=f"File not found: {file_id}")
+        if not uploaded_files[file_id]["processed"]:
+            raise HTTPException(status_code=400, detail="File is still being processed")
+    
+    return file_ids, scope
+
 @app.post("/api/query", response_model=QueryResponse)
 async def query_document(request: QueryRequest):
     """Process queries against uploaded documents using real RAG"""
     
-    if request.file_id not in uploaded_files:
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    file_info = uploaded_files[request.file_id]
-    
-    if not file_info["processed"]:
-        raise HTTPException(status_code=400, detail="File is still being processed")
+    file_ids, scope = resolve_query_files(request)
+    file_name = ", ".join(uploaded_files[file_id]["original_name"] for file_id in file_ids)
     
     try:
         # CRITICAL FIX: Ensure credentials are loaded before any RAG processing
@@ -595,32 +2902,81 @@ async def query_document(request: QueryRequest):
                 if not (api_key and project_id):
                     # Fall back to demo mode
                     encouragement = get_encouragement()
-                    demo_answer = f"🤖 Demo Mode: I would analyze your document '{file_info['original_name']}' to answer: '{request.query}'\n\nIBM Watson credentials not available.\n\n🌟 {encouragement}"
+                    demo_answer = f"🤖 Demo Mode: I would analyze your document '{file_name}' to answer: '{request.query}'\n\nIBM Watson credentials not available.\n\n🌟 {encouragement}"
                     
                     return QueryResponse(
                         answer=demo_answer,
-                        file_name=file_info["original_name"]
+                        file_name=file_name
                     )
         
         # Use real RAG processing
-        file_path = file_info["file_path"]
-        answer = retriever_qa(file_path, request.query)
+        if scope is None:
+            file_path = uploaded_files[file_ids[0]]["file_path"]
+            answer = await run_query_job(retriever_qa, file_path, request.query, file_ids[0])
+        else:
+            answer = await run_query_job(retriever_qa_multi, file_ids, request.query, scope)
         
         return QueryResponse(
             answer=answer,
-            file_name=file_info["original_name"]
+            file_name=file_name
         )
-        
+    
+    except HTTPException:
+        raise
     except Exception as e:
         # Fallback to demo response with encouragement
         encouragement = get_encouragement()
-        demo_answer = f"🤖 I would analyze your document '{file_info['original_name']}' to answer: '{request.query}'\n\n[Real RAG processing failed: {str(e)}]\n\n🌟 {encouragement}"
+        demo_answer = f"🤖 I would analyze your document '{file_name}' to answer: '{request.query}'\n\n[Real RAG processing failed: {str(e)}]\n\n🌟 {encouragement}"
         
         return QueryResponse(
             answer=demo_answer,
-            file_name=file_info["original_name"]
+            file_name=file_name
         )
 
+@app.post("/api/query/stream")
+async def query_document_stream(request: QueryRequest):
+    """Stream the answer as server-sent events while the LLM generates it"""
+    
+    file_ids, scope = resolve_query_files(request)
+    file_name = ", ".join(uploaded_files[file_id]["original_name"] for file_id in file_ids)
+    
+    if RAG_AVAILABLE and not (os.getenv('IBM_API_KEY') and os.getenv('IBM_PROJECT_ID')):
+        print("🔍 Credentials not in environment for query, loading them now...")
+        api_key, project_id = setup_credentials()
+        if not (api_key and project_id):
+            encouragement = get_encouragement()
+            demo_answer = f"🤖 Demo Mode: I would analyze your document '{file_name}' to answer: '{request.query}'\n\nIBM Watson credentials not available.\n\n🌟 {encouragement}"
+            tokens = iter_sse([demo_answer], file_name)
+            return StreamingResponse(tokens, media_type="text/event-stream")
+    
+    if scope is None:
+        tokens = await stream_query_job(
+            retriever_qa_stream, uploaded_files[file_ids[0]]["file_path"], request.query, file_ids[0]
+        )
+    else:
+        tokens = await stream_query_job(retriever_qa_multi_stream, file_ids, request.query, scope)
+    return StreamingResponse(
+        iter_sse(tokens, file_name),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def iter_sse(tokens, file_name):
+    """Format answer tokens as server-sent events, ending with a done event"""
+    try:
+        if hasattr(tokens, "__aiter__"):
+            async for token in tokens:
+                yield f"data: {json.dumps({'token': token})}\n\n"
+        else:
+            for token in tokens:
+                yield f"data: {json.dumps({'token': token})}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    finally:
+        if hasattr(tokens, "aclose"):
+            await tokens.aclose()
+    yield f"event: done\ndata: {json.dumps({'file_name': file_name})}\n\n"
+
 @app.get("/api/files")
 async def list_files():
     """List all uploaded files"""
@@ -629,29 +2985,71 @@ async def list_files():
             {
                 "file_id": file_id,
                 "name": info["original_name"],
-                "processed": info["processed"]
+                "processed": info["processed"],
+                "status": info.get("status"),
+                "collection": info.get("collection"),
+                "index_id": info.get("index_id", file_id),
+                "index_refs": len(index_refs(info.get("index_id", file_id))),
+                "size_bytes": info.get("size_bytes")
             }
-            for file_id, info in uploaded_files.items()
+            for file_id, info in list(uploaded_files.items())
         ]
     }
 
+@app.get("/api/collections")
+async def list_collections():
+    """List collections and the files they contain"""
+    collections = {}
+    for file_id, info in uploaded_files.items():
+        if info.get("collection"):
+            collections.setdefault(info["collection"], []).append({
+                "file_id": file_id,
+                "name": info["original_name"],
+                "processed": info["processed"]
+            })
+    return {"collections": collections}
+
+@app.get("/api/files/{file_id}/status")
+async def get_file_status(file_id: str):
+    """Report ingestion progress for an uploaded file"""
+    if file_id not in uploaded_files:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    file_info = uploaded_files[file_id]
+    return {
+        "file_id": file_id,
+        "file_name": file_info["original_name"],
+        "status": file_info.get("status", "ready" if file_info["processed"] else "queued"),
+        "stage": file_info.get("stage"),
+        "processed": file_info["processed"],
+        "chunk_count": file_info.get("chunk_count"),
+        "processing_error": file_info.get("processing_error")
+    }
+
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: str):
     """Delete an uploaded file"""
     if file_id not in uploaded_files:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_info = uploaded_files[file_id]
+    # Remove from memory; the stored file and index go with the last upload
+    # that references them
+    file_info = uploaded_files.pop(file_id)
+    index_id = file_info.get("index_id", file_id)
+    remaining = len(index_refs(index_id))
+    if not remaining:
+        release_index(index_id, file_info)
+    answer_cache.invalidate(file_id)
+    if file_info.get("collection"):
+        answer_cache.invalidate(f"collection:{file_info['collection']}")
+    save_file_registry()
     
-    # Delete file from disk
-    file_path = Path(file_info["file_path"])
-    if file_path.exists():
-        file_path.unlink()
-    
-    # Remove from memory
-    del uploaded_files[file_id]
-    
-    return {"status": "success", "message": "File deleted successfully"}
+    return {
+        "status": "success",
+        "message": "File deleted successfully",
+        "index_released": not remaining,
+        "index_refs": remaining
+    }
 
 @app.get("/api/debug")
 async def debug_info():
@@ -669,6 +3067,25 @@ async def debug_info():
         }
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics: stage timings, cache hits, token counts and queue depths"""
+    statuses = {}
+    for file_info in list(uploaded_files.values()):
+        status = file_info.get("status", "unknown")
+        statuses[status] = statuses.get(status, 0) + 1
+    gauges = [
+        ("rag_queries_in_flight", "Queries running or waiting on the query pool", queries_in_flight),
+        ("rag_cached_retrievers", "Retrievers held in the retriever cache", len(retriever_cache)),
+        ("rag_uploaded_files", "Uploaded files known to the service", len(uploaded_files)),
+        ("rag_indexes", "Distinct document indexes shared by uploaded files",
+         len({info.get("index_id", file_id) for file_id, info in list(uploaded_files.items())})),
+        ("rag_embedding_concurrency", "Current adaptive embedding concurrency limit", embed_limiter.limit),
+    ]
+    for status, count in sorted(statuses.items()):
+        gauges.append(("rag_files", "Uploaded files by processing status", count, {"status": status}))
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/status")
 async def get_system_status():
     """Get system status including RAG availability"""
@@ -676,7 +3093,14 @@ async def get_system_status():
         "rag_available": RAG_AVAILABLE,
         "rag_initialized": rag_initialized,
         "credentials_configured": bool(os.getenv('IBM_API_KEY') and os.getenv('IBM_PROJECT_ID')),
-        "uploaded_files_count": len(uploaded_files)
+        "uploaded_files_count": len(uploaded_files),
+        "indexes_count": len({info.get("index_id", file_id) for file_id, info in list(uploaded_files.items())}),
+        "cached_retrievers": len(retriever_cache),
+        "queries_in_flight": queries_in_flight,
+        "answer_cache": answer_cache.stats(),
+        "embedding_backend": EMBEDDING_BACKEND,
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "documents": document_table.count()
     }
 
 @app.post("/api/initialize")
@@ -699,13 +3123,13 @@ async def initialize_rag():
         
         # Credentials are already set in os.environ by setup_credentials()
         
-        # Test the connection
-        test_llm = get_llm()
-        test_embedding = watsonx_embedding()
+        # Test the connection and keep the clients for later requests
+        get_llm()
+        watsonx_embedding()
         
         rag_initialized = True
         return {"status": "success", "message": "RAG system initialized successfully"}
-        
+    
     except Exception as e:
         rag_initialized = False
         raise HTTPException(status_code=500, detail=f"Failed to initialize RAG system: {str(e)}")
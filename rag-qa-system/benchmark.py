@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+End-to-end RAG benchmark with fake LLM and embedding providers
+
+Generates a corpus of PDF, DOCX and TXT resumes, then times each pipeline
+stage in-process (document_loader_universal, text_splitter, vector_database,
+create_retriever) and over HTTP (/api/upload until the file is ready, and
+/api/query with concurrent clients). Watsonx is never contacted: embeddings
+come from a deterministic hashing backend and answers from a fake LLM, each
+with an optional simulated latency.
+
+Reports latency percentiles, throughput and peak RSS per stage, and can save
+the results and compare them against a saved baseline to catch regressions
+before deploying.
+
+Usage:
+    python benchmark.py --docs 6 --pages 20 --queries 60 --clients 4
+    python benchmark.py --save bench_results/baseline.json
+    python benchmark.py --baseline bench_results/baseline.json --tolerance 0.25
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+# app.py expects to run from its own directory (static/, uploads/)
+os.chdir(Path(__file__).resolve().parent)
+sys.path.insert(0, os.getcwd())
+
+# Select the fake providers before app.py reads its configuration
+os.environ.setdefault('IBM_API_KEY', 'benchmark-api-key')
+os.environ.setdefault('IBM_PROJECT_ID', 'benchmark-project-id')
+os.environ['RAG_EMBEDDING_BACKEND'] = 'benchmark'
+os.environ['RAG_EMBEDDING_CACHE'] = ''
+os.environ['RAG_PERSIST'] = '0'
+
+import uvicorn
+import app as rag_app
+from langchain_core.language_models.llms import LLM
+
+# === FAKE PROVIDERS ===
+class BenchmarkEmbeddings(rag_app.HashingEmbeddings):
+    """Hashing embeddings with a fixed per-call delay standing in for the network"""
+    
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.model_id = "benchmark-hashing"
+        self.latency = latency
+    
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+class BenchmarkLLM(LLM):
+    """Deterministic LLM whose answer is derived from a hash of the prompt"""
+    
+    latency: float = 0.0
+    
+    @property
+    def _llm_type(self):
+        return "benchmark"
+    
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        return f"Benchmark answer {digest} from a {len(prompt)} character prompt."
+
+# === CORPUS ===
+SKILLS = [
+    "Python", "Kubernetes", "Terraform", "PostgreSQL", "React", "Node.js", "C++",
+    "Java", "Spark", "Kafka", "AWS", "Azure", "Docker", "GraphQL", "Rust", "Go",
+]
+COMPANIES = ["Acme Corp", "Globex", "Initech", "Umbrella", "Hooli", "Stark Industries", "Wayne Enterprises"]
+PHRASES = [
+    "led a team of engineers delivering", "designed and maintained", "reduced latency of",
+    "migrated the legacy platform to", "built data pipelines with", "mentored junior developers on",
+    "improved test coverage for", "automated deployments using", "owned the on-call rotation for",
+]
+
+def make_pages(rng, pages, lines_per_page=45):
+    """Resume-like pages of text, one list of lines per page"""
+    result = []
+    for page in range(pages):
+        lines = [f"Experience section {page + 1}"]
+        for _ in range(lines_per_page):
+            lines.append(
+                f"At {rng.choice(COMPANIES)} {rng.choice(PHRASES)} {rng.choice(SKILLS)} "
+                f"and {rng.choice(SKILLS)} services for {rng.randint(2, 12)} years."
+            )
+        result.append(lines)
+    return result
+
+def write_txt(path, pages):
+    path.write_text("\n\n".join("\n".join(lines) for lines in pages), encoding="utf-8")
+
+def write_docx(path, pages):
+    """Minimal WordprocessingML package: one paragraph per line"""
+    paragraphs = "".join(
+        f'<w:p><w:r><w:t xml:space="preserve">{escape(line)}</w:t></w:r></w:p>'
+        for lines in pages for line in lines
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        docx.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/></Relationships>'
+        ))
+        docx.writestr("word/document.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{paragraphs}</w:body></w:document>'
+        ))
+
+def write_pdf(path, pages):
+    """Minimal PDF with one Helvetica text page per page of lines"""
+    def pdf_string(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    
+    page_count = len(pages)
+    page_ids = [4 + 2 * i for i in range(page_count)]
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{pid} 0 R' for pid in page_ids)}] /Count {page_count} >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for page_id, lines in zip(page_ids, pages):
+        content = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({pdf_string(line)}) Tj T*" for line in lines) + " ET"
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        )
+        objects[page_id + 1] = f"<< /Length {len(content)} >>\nstream\n{content}\nendstream"
+    
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(out)
+        out += f"{number} 0 obj\n{objects[number]}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for number in sorted(objects):
+        out += f"{offsets[number]:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    path.write_bytes(bytes(out))
+
+WRITERS = {".pdf": write_pdf, ".docx": write_docx, ".txt": write_txt}
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+}
+
+def generate_corpus(directory, docs, pages, seed):
+    """Write `docs` documents cycling through PDF, DOCX and TXT"""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(docs):
+        extension = list(WRITERS)[i % len(WRITERS)]
+        path = Path(directory) / f"resume_{i:03d}{extension}"
+        WRITERS[extension](path, make_pages(rng, pages))
+        paths.append(path)
+    return paths
+
+# === MEASUREMENT ===
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class StageTimer:
+    """Collects per-stage latencies, wall time and the peak RSS after each stage"""
+    
+    def __init__(self):
+        self.stages = {}
+    
+    def _stage(self, name):
+        return self.stages.setdefault(name, {"latencies": [], "wall": 0.0, "peak_rss_mb": 0.0})
+    
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self._stage(name)
+            stage["latencies"].append(time.perf_counter() - start)
+            stage["peak_rss_mb"] = peak_rss_mb()
+    
+    def record(self, name, latency):
+        stage = self._stage(name)
+        stage["latencies"].append(latency)
+        stage["peak_rss_mb"] = peak_rss_mb()
+    
+    def set_wall(self, name, seconds):
+        self._stage(name)["wall"] = seconds
+    
+    def summary(self):
+        result = {}
+        for name, stage in self.stages.items():
+            latencies = stage["latencies"]
+            # Concurrent stages report their wall time; serial ones the summed latency
+            wall = stage["wall"] or sum(latencies)
+            result[name] = {
+                "count": len(latencies),
+                "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "throughput": len(latencies) / wall if wall else 0.0,
+                "peak_rss_mb": stage["peak_rss_mb"],
+            }
+        return result
+
+# === IN-PROCESS STAGES ===
+def run_library_stages(timer, corpus, repeat):
+    """Time each pipeline function on every document of the corpus"""
+    for _ in range(repeat):
+        for path in corpus:
+            with timer.measure("load"):
+                docs = rag_app.document_loader_universal(str(path))
+            with timer.measure("split"):
+                chunks = rag_app.text_splitter(docs)
+            with timer.measure("vector_database"):
+                vectordb = rag_app.vector_database(chunks)
+            vectordb.delete_collection()
+            with timer.measure("create_retriever"):
+                retriever, _, _ = rag_app.create_retriever(str(path))
+            retriever.vectorstore.delete_collection()
+
+# === HTTP STAGES ===
+# app.py turns pipeline errors and missing credentials into HTTP 200 answers,
+# so a query only counts as a success if its answer is not one of those
+DEMO_ANSWER_PREFIX = "🤖"
+ERROR_ANSWER_TEXT = "Sorry, I encountered an error"
+
+def start_server(port):
+    """Run the FastAPI app on a background thread and wait until it is up"""
+    config = uvicorn.Config(rag_app.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    
+    for _ in range(200):
+        if server.started:
+            return server, thread
+        time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+def request_json(url, payload=None, method="GET", body=None, headers=None):
+    """Send a request and return (status_code, parsed_response)"""
+    if payload is not None:
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+    request = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+def upload_file(base_url, path):
+    """POST a file to /api/upload as multipart form data"""
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{path.name}"\r\n'
+        f"Content-Type: {CONTENT_TYPES[path.suffix]}\r\n\r\n"
+    ).encode("utf-8") + path.read_bytes() + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return request_json(
+        f"{base_url}/api/upload", method="POST", body=body,
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    )
+
+def answer_failure(status, body):
+    """Return why a query response is a failure, or None if it succeeded"""
+    if status != 200:
+        return f"HTTP {status}"
+    answer = (body or {}).get("answer", "")
+    if answer.startswith(DEMO_ANSWER_PREFIX):
+        return "demo answer"
+    if ERROR_ANSWER_TEXT in answer:
+        return "error answer"
+    return None
+
+def wait_until_ready(base_url, file_id, timeout=300):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        _, status = request_json(f"{base_url}/api/files/{file_id}/status")
+        if status and status.get("status") in ("ready", "failed"):
+            return status["status"]
+        time.sleep(0.02)
+    raise RuntimeError(f"Timed out waiting for {file_id} to be ingested")
+
+def run_http_stages(timer, corpus, base_url, queries, clients):
+    """Time uploads through ingestion, then concurrent queries over the uploads"""
+    file_ids = []
+    for path in corpus:
+        start = time.perf_counter()
+        status, body = upload_file(base_url, path)
+        timer.record("api_upload", time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError(f"Upload of {path.name} failed with HTTP {status}")
+        if wait_until_ready(base_url, body["file_id"]) != "ready":
+            raise RuntimeError(f"Ingestion of {path.name} failed")
+        timer.record("api_upload_to_ready", time.perf_counter() - start)
+        file_ids.append(body["file_id"])
+    
+    skills = iter(range(queries))
+    lock = threading.Lock()
+    failures = []
+    
+    def client():
+        while True:
+            with lock:
+                i = next(skills, None)
+            if i is None:
+                return
+            # Distinct questions so the answer cache does not short-circuit the pipeline
+            question = f"Which projects used {SKILLS[i % len(SKILLS)]}? ({i})"
+            start = time.perf_counter()
+            status, body = request_json(f"{base_url}/api/query", {
+                "query": question,
+                "file_id": file_ids[i % len(file_ids)]
+            }, method="POST")
+            elapsed = time.perf_counter() - start
+            failure = answer_failure(status, body)
+            with lock:
+                if failure is None:
+                    timer.record("api_query", elapsed)
+                else:
+                    failures.append(failure)
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        workers = [pool.submit(client) for _ in range(clients)]
+        for worker in workers:
+            worker.result()  # re-raise a client that crashed instead of timing a partial run
+    timer.set_wall("api_query", time.perf_counter() - start)
+    
+    for file_id in file_ids:
+        request_json(f"{base_url}/api/files/{file_id}", method="DELETE")
+    return failures
+
+# === REPORTING ===
+def print_report(summary):
+    print()
+    print(f"{'stage':<20} {'n':>5} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'ops/s':>9} {'peak RSS (MB)':>14}")
+    for name, stats in summary.items():
+        print(f"{name:<20} {stats['count']:>5} {stats['p50'] * 1000:>10.1f} {stats['p95'] * 1000:>10.1f} "
+              f"{stats['p99'] * 1000:>10.1f} {stats['throughput']:>9.2f} {stats['peak_rss_mb']:>14.1f}")
+
+def compare_with_baseline(summary, baseline_path, tolerance):
+    """Print stages that regressed by more than `tolerance` or went missing; return True if any did"""
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))["stages"]
+    regressions = []
+    for name, previous in baseline.items():
+        stats = summary.get(name)
+        if not stats or not stats["count"]:
+            # A stage with no successful samples would otherwise pass silently
+            regressions.append(f"{name}: no samples in this run")
+            continue
+        for metric in ("p50", "p95"):
+            if previous[metric] and stats[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {previous[metric] * 1000:.1f}ms -> {stats[metric] * 1000:.1f}ms")
+    
+    print()
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) beyond {tolerance:.0%} of {baseline_path}:")
+        for line in regressions:
+            print(f"   {line}")
+    else:
+        print(f"✅ No regressions beyond {tolerance:.0%} of {baseline_path}")
+    return bool(regressions)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline with fake LLM and embeddings")
+    parser.add_argument("--docs", type=int, default=6, help="documents in the generated corpus")
+    parser.add_argument("--pages", type=int, default=10, help="pages per document")
+    parser.add_argument("--repeat", type=int, default=2, help="passes over the corpus for in-process stages")
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent /api/query clients")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="simulated seconds per embedding call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per LLM call")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=7898)
+    parser.add_argument("--save", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="JSON results from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs the baseline")
+    args = parser.parse_args()
+    
+    rag_app.register_embedding_backend("benchmark", lambda: BenchmarkEmbeddings(args.embed_latency))
+    llm = BenchmarkLLM(latency=args.llm_latency)
+    rag_app.get_llm = lambda: llm
+    
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as directory:
+        corpus = generate_corpus(directory, args.docs, args.pages, args.seed)
+        total_mb = sum(path.stat().st_size for path in corpus) / (1024 * 1024)
+        print(f"📚 Generated {len(corpus)} documents ({total_mb:.1f} MB) in {directory}")
+        
+        run_library_stages(timer, corpus, args.repeat)
+        
+        server, thread = start_server(args.port)
+        try:
+            failures = run_http_stages(timer, corpus, f"http://127.0.0.1:{args.port}", args.queries, args.clients)
+        finally:
+            server.should_exit = True
+            thread.join(timeout=5)
+    
+    summary = timer.summary()
+    print_report(summary)
+    if failures:
+        print(f"❌ {len(failures)} query request(s) failed: {sorted(set(failures))}")
+    
+    if args.save:
+        save_path = Path(args.save)
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        save_path.write_text(json.dumps({"args": vars(args), "stages": summary}, indent=2), encoding="utf-8")
+        print(f"💾 Saved results to {save_path}")
+    
+    regressed = bool(args.baseline) and compare_with_baseline(summary, args.baseline, args.tolerance)
+    if failures or regressed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
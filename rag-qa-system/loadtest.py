@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Load test for /api/query with a stubbed LLM
+
+Starts app.py in-process with retriever_qa() replaced by a stub that sleeps
+for a fixed "LLM latency", then drives /api/query with N concurrent clients
+and reports throughput and latency for each concurrency level.
+
+Usage:
+    python loadtest.py --clients 1 2 4 8 16 --requests 20 --latency 0.5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# app.py expects to run from its own directory (static/, uploads/)
+os.chdir(Path(__file__).resolve().parent)
+sys.path.insert(0, os.getcwd())
+
+# Without credentials /api/query answers in demo mode and never reaches the stub
+os.environ.setdefault('IBM_API_KEY', 'loadtest-api-key')
+os.environ.setdefault('IBM_PROJECT_ID', 'loadtest-project-id')
+
+import uvicorn
+import app as rag_app
+
+def stub_retriever_qa(latency):
+    """Build a retriever_qa replacement that just blocks for `latency` seconds"""
+    def retriever_qa(file_path, query, file_id=None):
+        time.sleep(latency)
+        return f"Stub answer for '{query}' on {os.path.basename(file_path)}"
+    return retriever_qa
+
+def start_server(port):
+    """Run the FastAPI app on a background thread and wait until it is up"""
+    config = uvicorn.Config(rag_app.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    
+    for _ in range(100):
+        if server.started:
+            return server, thread
+        time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+def post_json(url, payload):
+    """POST a JSON body and return (status_code, parsed_response)"""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+def register_test_file():
+    """Add a processed file entry for the load test to query"""
+    file_path = rag_app.UPLOAD_DIR / "loadtest.txt"
+    file_path.write_text("Load test document\n", encoding="utf-8")
+    file_id = "loadtest"
+    rag_app.uploaded_files[file_id] = {
+        "original_name": "loadtest.txt",
+        "file_path": str(file_path),
+        "content_type": "text/plain",
+        "file_extension": ".txt",
+        "processed": True,
+        "processing_error": None,
+        "status": "ready",
+        "stage": "indexed"
+    }
+    return file_id, file_path
+
+def run_level(base_url, file_id, clients, requests_per_client):
+    """Drive /api/query with `clients` concurrent clients"""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    
+    def client(client_index):
+        for i in range(requests_per_client):
+            start = time.perf_counter()
+            status, _ = post_json(f"{base_url}/api/query", {
+                "query": f"question {client_index}-{i}",
+                "file_id": file_id
+            })
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    wall = time.perf_counter() - start
+    
+    return {
+        "clients": clients,
+        "ok": statuses.get(200, 0),
+        "rejected": sum(count for status, count in statuses.items() if status != 200),
+        "throughput": statuses.get(200, 0) / wall if wall else 0.0,
+        "p50": statistics.median(latencies) if latencies else 0.0,
+        "p95": statistics.quantiles(latencies, n=20)[-1] if len(latencies) >= 2 else (latencies[0] if latencies else 0.0),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/query with a stubbed LLM")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=10, help="requests per client")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM latency in seconds")
+    parser.add_argument("--port", type=int, default=7899)
+    args = parser.parse_args()
+    
+    rag_app.retriever_qa = stub_retriever_qa(args.latency)
+    file_id, file_path = register_test_file()
+    server, thread = start_server(args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    
+    print(f"🚀 Load testing {base_url}/api/query")
+    print(f"   Stub LLM latency: {args.latency}s, query workers: {rag_app.QUERY_WORKERS}, "
+          f"max pending: {rag_app.QUERY_MAX_PENDING}")
+    print()
+    print(f"{'clients':>8} {'ok':>6} {'rejected':>9} {'req/s':>8} {'p50 (s)':>9} {'p95 (s)':>9}")
+    
+    try:
+        for clients in args.clients:
+            result = run_level(base_url, file_id, clients, args.requests)
+            print(f"{result['clients']:>8} {result['ok']:>6} {result['rejected']:>9} "
+                  f"{result['throughput']:>8.2f} {result['p50']:>9.3f} {result['p95']:>9.3f}")
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+        rag_app.uploaded_files.pop(file_id, None)
+        if file_path.exists():
+            file_path.unlink()
+
+if __name__ == "__main__":
+    main()